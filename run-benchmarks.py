@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import sys
+import fire
+from trade_screenshots import benchmark
+
+
+def main(
+    years=1.0,
+    charts=10,
+    repeat=3,
+    stages='',
+    baseline='benchmark-baseline.json',
+    save=False,
+    tolerance=benchmark.DEFAULT_TOLERANCE,
+    workdir=None
+):
+    """
+    Time the chart pipeline stages (bar loading per provider, TA, split, transform, levels, figure build and image
+    export) on synthetic 1min bars and compare them with a stored baseline.
+    :param years: Years of synthetic 1min bars (with ETH, holidays and missing bars)
+    :param charts: Number of charts built and exported by the chart stages
+    :param repeat: Runs per stage, the best time is reported
+    :param stages: Comma separated subset of benchmark.STAGES, e.g. 'ta,split', default all
+    :param baseline: JSON file with the baseline timings
+    :param save: Store the timings of this run as the baseline (instead of failing on regressions)
+    :param tolerance: Fraction a stage may be slower than its baseline before it is flagged as a regression
+    :param workdir: Keep the generated bar files, caches and images in this directory
+    """
+    if isinstance(stages, str):
+        stages = [stage for stage in stages.split(',') if stage]
+    params = {'years': years, 'charts': charts}
+    results = benchmark.run(years, charts, repeat, list(stages) or None, workdir)
+
+    previous = benchmark.load_baseline(baseline)
+    if previous is not None and previous['params'] != params:
+        print(f"Baseline '{baseline}' was created with {previous['params']}, not comparing")
+        previous = None
+    print(benchmark.report(results, previous, tolerance))
+
+    if save:
+        benchmark.save_baseline(baseline, results, params)
+        print(f"Saved baseline '{baseline}'")
+    elif previous is not None:
+        slower = benchmark.regressions(results, previous, tolerance)
+        if slower:
+            print(f"Regressions (more than {tolerance:.0%} slower): {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
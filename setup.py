@@ -11,4 +11,7 @@ setup(
         'fire',
         'finta'
     ],
+    extras_require={
+        'matplotlib': ['matplotlib'],
+    },
 )
\ No newline at end of file
@@ -25,7 +25,16 @@ def main(
     days_before=1,
     days_after=20,
     daily_plot=True,
-    transform=''
+    transform='',
+    workers=0,
+    renderers=0,
+    renderer='plotly',
+    force=False,
+    render_mode='process',
+    levels=None,
+    report='',
+    profile='',
+    profiler='cprofile'
 ):
     """
     This function generates trade screenshots for a given set of symbols and timeframes.
@@ -39,7 +48,18 @@ def main(
     :param days: The number of days after SIP date, use 0 for all available data (max 30 days for intraday timeframe)
     :param daily_plot: Generate daily plot (if SIP intraday timeframe)
     :param transform: Transform the original OHLC data into this timeframe
+    :param workers: Number of processes to handle symbols in parallel, 0 to run sequentially
+    :param renderers: Number of image export processes (or threads), 0 to export the images while creating the charts
+    :param render_mode: 'process' for export processes shared by all workers, 'thread' for export threads in each worker
+    :param renderer: Image backend, 'plotly' (Kaleido) or 'matplotlib'
+    :param force: Recreate all charts, also those unchanged since the last run (see '<outdir>/manifest.json')
+    :param levels: Levels drawn on the intraday charts, e.g. 'yday_mid,or30_high,or30_low' (default sip_handler.SIP_LEVELS)
+    :param report: Write a JSON report of the run (per stage/symbol/chart timings, cache hit rates, peak RSS) to this file
+    :param profile: Write a profile of each symbol to this directory
+    :param profiler: 'cprofile' or 'pyinstrument' (if installed)
     """
+    if isinstance(levels, str):
+        levels = levels.split(',')
 
     if symbol:
         config = SipConfig(
@@ -55,7 +75,16 @@ def main(
             days_after=days_after,
             paths=PATHS,
             gen_daily=daily_plot,
-            ta_indicators=['EMA10', 'VWAP']
+            ta_indicators=['EMA10', 'VWAP'],
+            workers=workers,
+            renderers=renderers,
+            render_mode=render_mode,
+            renderer=renderer,
+            force=force,
+            levels=list(levels) if levels is not None else None,
+            report=report,
+            profile=profile,
+            profiler=profiler
         )
         handle_sip(config)
     elif sip_file:
@@ -71,7 +100,16 @@ def main(
             days_before=days_before,
             days_after=days_after,
             paths=PATHS,
-            gen_daily=daily_plot            
+            gen_daily=daily_plot,
+            workers=workers,
+            renderers=renderers,
+            render_mode=render_mode,
+            renderer=renderer,
+            force=force,
+            levels=list(levels) if levels is not None else None,
+            report=report,
+            profile=profile,
+            profiler=profiler
         )
         handle_sip(config)
     else:
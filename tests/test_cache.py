@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+import pytest
+
+from trade_screenshots import benchmark, cache, instrument
+
+
+def write_source(path, df, mtime_ns):
+    df.to_csv(path)
+    # Distinct mtimes so the cache sees each rewrite, even one within the file system's timestamp resolution
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def read_source(path):
+    return pd.read_csv(path, index_col='DateTime', parse_dates=True)
+
+
+def cached(path, **kwargs):
+    instrument.snapshot()
+    df = cache.cached(path, lambda: read_source(path), **kwargs)
+    return df, instrument.snapshot()['counters']
+
+
+def test_cached_rebuilds_when_source_changes(tmp_path):
+    path = str(tmp_path / 'bars.csv')
+    df = benchmark.synthetic_bars(years=0.01)
+    write_source(path, df, 1_000_000_000)
+
+    first, counters = cached(path)
+    assert counters == {'bars_cache.miss': 1}
+    pd.testing.assert_frame_equal(first, df, check_freq=False)
+    second, counters = cached(path)
+    assert counters == {'bars_cache.hit': 1}
+    pd.testing.assert_frame_equal(second, df, check_freq=False)
+
+    # Fewer rows change the size
+    shorter = df.iloc[:-100]
+    write_source(path, shorter, 2_000_000_000)
+    assert cache.read_meta(path) is None
+    result, counters = cached(path)
+    assert counters == {'bars_cache.miss': 1}
+    pd.testing.assert_frame_equal(result, shorter, check_freq=False)
+    assert cache.read_meta(path)['rows'] == len(shorter)
+
+    # Same size, only the mtime tells the rewrite apart
+    changed = shorter.copy()
+    changed['Volume'] = changed['Volume'].iloc[::-1].to_numpy()
+    size = os.path.getsize(path)
+    write_source(path, changed, 3_000_000_000)
+    assert os.path.getsize(path) == size
+    assert cache.read_meta(path) is None
+    result, counters = cached(path)
+    assert counters == {'bars_cache.miss': 1}
+    pd.testing.assert_frame_equal(result, changed, check_freq=False)
+    result, counters = cached(path)
+    assert counters == {'bars_cache.hit': 1}
+    pd.testing.assert_frame_equal(result, changed, check_freq=False)
+
+
+@pytest.mark.parametrize('copy', [True, False])
+def test_cached_views_are_read_only_without_copy(tmp_path, copy):
+    path = str(tmp_path / 'bars.csv')
+    df = benchmark.synthetic_bars(years=0.01)
+    write_source(path, df, 1_000_000_000)
+    cached(path)
+
+    start, end = df.index[100], df.index[200]
+    result, counters = cached(path, start=start, end=end, copy=copy)
+    assert counters == {'bars_cache.hit': 1}
+    pd.testing.assert_frame_equal(result, df.iloc[100:200], check_freq=False)
+    values = result['Close'].to_numpy()
+    assert values.flags.writeable == copy
+    if copy:
+        values[0] = 0
+    else:
+        with pytest.raises(ValueError):
+            values[0] = 0
+    # Neither way writes through to the cache
+    pd.testing.assert_frame_equal(cache.load(path, start, end), df.iloc[100:200], check_freq=False)
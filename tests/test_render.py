@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from trade_screenshots import instrument, render
+from trade_screenshots.manifest import Manifest
+
+
+FIG = {
+    'data': [{'type': 'candlestick', 'x': ['2023-01-02 09:30', '2023-01-02 09:31'], 'open': [1, 2], 'high': [2, 3], 'low': [0.5, 1.5],
+              'close': [1.5, 2.5]}],
+    'layout': {},
+}
+
+
+@pytest.mark.parametrize('mode', render.RENDER_MODES)
+def test_render_pool_discards_failed_exports(tmp_path, mode):
+    outdir = str(tmp_path)
+    manifest = Manifest(outdir)
+    good, bad = os.path.join(outdir, 'good'), os.path.join(outdir, 'bad')
+    # An older image in the way of the new one, which can't be written over a directory
+    os.makedirs(f"{bad}.png")
+    report = instrument.RunReport('')
+    with render.RenderPool(1, mode, report=report, manifest=manifest) as pool:
+        for filename in (good, bad):
+            assert render.submit(FIG, f"{filename}.png", 400, 300, 'matplotlib')
+            manifest.update({manifest.key(filename): 'digest'})
+    assert pool.failed == [f"{bad}.png"]
+    assert os.path.isfile(f"{good}.png")
+    assert manifest.updates == {manifest.key(good): 'digest'}
+    assert report.data()['failed_exports'] == [f"{bad}.png"]
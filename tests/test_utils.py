@@ -0,0 +1,176 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade_screenshots import benchmark, utils, utils_ta
+
+
+START, END = '2020-02-12 10:00', '2020-04-15'
+
+
+@pytest.fixture(scope='module')
+def bar_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('bars')
+    bars = benchmark.synthetic_bars(years=0.4)
+    benchmark.write_alpaca_json(bars, utils.bars_path('alpaca-file', benchmark.SYMBOL, '1min', str(path)))
+    benchmark.write_alpaca_json(utils.transform_timeframe(bars, '1min', 'day'), utils.bars_path('alpaca-file', benchmark.SYMBOL, 'day', str(path)))
+    return str(path)
+
+
+@pytest.mark.parametrize('timeframe, transform', [('1min', '7min'), ('1min', '60min'), ('1min', 'day'), ('day', 'week'), ('day', 'month')])
+def test_get_dataframe_transform_has_whole_periods(bar_dir, timeframe, transform):
+    # Bounds pushed down to the bar loading must not cut the first or last period of the transform
+    full = utils.get_dataframe('alpaca-file', benchmark.SYMBOL, '', '', timeframe, path=bar_dir)
+    expected = utils.filter_date(utils.transform_timeframe(full, timeframe, transform), START, END)
+    result = utils.get_dataframe('alpaca-file', benchmark.SYMBOL, START, END, timeframe, path=bar_dir, transform=transform)
+    assert not result.empty
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+
+
+def write_json_bars(path, symbols, indent, utc_suffix):
+    data = {}
+    for i, symbol in enumerate(symbols):
+        bars = benchmark.synthetic_bars(years=0.01, timeframe='5min', seed=i)
+        dates = bars.index.tz_localize('America/New_York').tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%S') + utc_suffix
+        data[symbol] = [dict(DateTime=date, Open=o, High=h, Low=l, Close=c, Volume=int(v))
+                        for date, o, h, l, c, v in zip(dates, *(bars[col].tolist() for col in utils.JSON_COLUMNS))]
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=indent)
+
+
+@pytest.mark.parametrize('chunk_size', [97, utils.JSON_CHUNK_SIZE])
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('utc_suffix', ['Z', '+00:00'])
+@pytest.mark.parametrize('bounds', [(None, None), ('2020-01-03', '2020-01-07 12:00')])
+def test_stream_json_dataframe_matches_json_to_dataframe(tmp_path, monkeypatch, chunk_size, indent, utc_suffix, bounds):
+    # Small chunks end at arbitrary points of the bar objects and keys
+    monkeypatch.setattr(utils, 'JSON_CHUNK_SIZE', chunk_size)
+    path = str(tmp_path / 'bars.json')
+    write_json_bars(path, ['SYNA', 'SYN', 'SYNB'], indent, utc_suffix)
+    start, end = (pd.Timestamp(bound) if bound else None for bound in bounds)
+
+    expected = utils.json_to_dataframe('SYN', '5min', utils.load_json_data('SYN', path))
+    if start is not None:
+        expected = expected[(expected.index >= start) & (expected.index < end)]
+    result = utils.stream_json_dataframe('SYN', '5min', path, start, end)
+    assert not result.empty
+    pd.testing.assert_frame_equal(result, expected.astype('float64'), check_freq=False, check_index_type=False)
+    assert result.attrs == {'symbol': 'SYN', 'timeframe': '5min'}
+
+
+def test_stream_json_dataframe_missing_symbol(tmp_path):
+    path = str(tmp_path / 'bars.json')
+    write_json_bars(path, ['SYNA'], None, 'Z')
+    assert utils.stream_json_dataframe('SYN', '5min', path).empty
+
+
+OHLCV_AGG = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+@pytest.mark.parametrize('transform', ['5min', '15min', '60min'])
+@pytest.mark.parametrize('anchor', ['', '09:30', '00:07'])
+def test_bucket_transform_matches_resample(transform, anchor):
+    # Synthetic bars have missing bars, holidays and nights without bars
+    df = benchmark.synthetic_bars(years=0.05)
+    offset = pd.Timedelta(f"{anchor}:00") if anchor else pd.Timedelta(0)
+    expected = df.resample(transform, offset=offset, origin='start_day').agg(OHLCV_AGG).dropna()
+    result = utils.transform_timeframe(df, '1min', transform, engine='bucket', anchor=anchor)
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+    assert result.attrs['timeframe'] == transform
+
+
+def test_bucket_transform_day_matches_resample():
+    df = benchmark.synthetic_bars(years=0.05, eth=False)
+    expected = df.resample('D').agg(OHLCV_AGG).dropna()
+    pd.testing.assert_frame_equal(utils.transform_timeframe(df, '1min', 'day', engine='bucket'), expected, check_freq=False)
+    pd.testing.assert_frame_equal(utils.transform_timeframe(df, '1min', 'day', engine='resample'), expected, check_freq=False)
+
+
+def test_bucket_resample_with_gaps_in_first_bucket():
+    # The first bar isn't at a bucket boundary and whole buckets are missing
+    df = benchmark.synthetic_bars(years=0.01, gap_fraction=0.3).iloc[3:]
+    expected = df.resample('15min', origin='start_day').agg(OHLCV_AGG).dropna()
+    result = utils.bucket_resample(df, 15 * utils.NS_PER_MINUTE)
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+
+
+def edge_bars():
+    """
+    Synthetic bars with a half day, a day without pre-market, a day with ETH bars only, a day without ETH bars, a day
+    without bars in the opening range and bars outside the ETH hours
+    """
+    df = benchmark.synthetic_bars(years=0.05)
+    days = df.index.normalize()
+    dates = days.unique()
+    tod = df.index - days
+    drop = ((days == dates[1]) & (tod >= pd.Timedelta('13:00:00'))) \
+        | ((days == dates[2]) & (tod < pd.Timedelta('09:30:00'))) \
+        | ((days == dates[3]) & (tod >= pd.Timedelta('09:30:00')) & (tod < pd.Timedelta('16:00:00'))) \
+        | ((days == dates[4]) & ((tod < pd.Timedelta('09:30:00')) | (tod >= pd.Timedelta('16:00:00')))) \
+        | ((days == dates[5]) & (tod >= pd.Timedelta('09:30:00')) & (tod < pd.Timedelta('10:45:00')))
+    extra = df.iloc[:2].copy()
+    extra.index = pd.DatetimeIndex([dates[6] + pd.Timedelta('02:00:00'), dates[6] + pd.Timedelta('20:30:00')], name='DateTime')
+    return pd.concat([df[~drop], extra]).sort_index()
+
+
+def old_split(df, start_time, end_time):
+    # The per-day between_time() version utils.split replaced
+    dfs, eth_values = [], {}
+    ah_df = None
+    for date, group_df in df.groupby(df.index.date):
+        filtered_df = group_df.between_time(start_time, end_time, inclusive='left')
+        pm_df = group_df.between_time('04:00', start_time, inclusive='left')
+        if not filtered_df.empty:
+            dfs.append(filtered_df)
+            eth_df = pd.concat([ah_df, pm_df]) if ah_df is not None else pm_df
+            eth_values[date] = {'low': eth_df['Low'].min(), 'high': eth_df['High'].max()}
+        ah_df = group_df.between_time(end_time, '20:00')
+    return dfs, eth_values
+
+
+def test_split_matches_between_time_split():
+    df = edge_bars()
+    expected, expected_eth = old_split(df, '09:30', '16:00')
+    eth_values = {}
+    result = utils.split(df, '09:30', '16:00', eth_values)
+    assert len(result) == len(expected)
+    for day, expected_day in zip(result, expected):
+        pd.testing.assert_frame_equal(day, expected_day)
+    assert eth_values.keys() == expected_eth.keys()
+    for date, values in expected_eth.items():
+        for key in ('low', 'high'):
+            np.testing.assert_equal(eth_values[date][key], values[key])
+
+
+def test_sessions_previous_day_levels():
+    df = edge_bars()
+    days, _ = old_split(df, '09:30', '16:00')
+    table = utils.sessions(df, '09:30', '16:00')
+    assert [day.index[0].date() for day in days] == table.dates.tolist()
+    yday = [None] + days[:-1]
+    np.testing.assert_equal(table.close_1, [day['Close'].iloc[-1] if day is not None else np.nan for day in yday])
+    np.testing.assert_equal(table.high_1, [day['High'].max() if day is not None else np.nan for day in yday])
+    np.testing.assert_equal(table.low_1, [day['Low'].min() if day is not None else np.nan for day in yday])
+
+
+@pytest.mark.parametrize('transform', ['', '5min', '60min'])
+def test_levels_table_matches_per_day_levels(transform):
+    df = edge_bars()
+    if transform:
+        df = utils.transform_timeframe(df, '1min', transform)
+    days, _ = old_split(df, '09:30', '16:00')
+    table = utils.levels_table(df)
+    assert table.index.date.tolist() == [day.index[0].date() for day in days]
+    # The day without bars 09:30-10:45 has an empty opening range (NaN), except for the hourly bar starting at 10:00
+    assert table['or_high'].isna().any() == (transform != '60min')
+    for day, (_, row) in zip(days, table.iterrows()):
+        or_low, or_high = utils_ta.or_levels(day, utils.OR_TIMES)
+        np.testing.assert_equal([row['or_low'], row['or_high']], [or_low, or_high])
+        np.testing.assert_equal([row['rth_low'], row['rth_high']], [day['Low'].min(), day['High'].max()])
+        np.testing.assert_equal(row['today_mid'], (day['Low'].min() + day['High'].max()) / 2)
+        for window in utils.OR_WINDOWS:
+            end = (pd.Timestamp('09:30') + pd.Timedelta(minutes=window)).strftime('%H:%M')
+            window_df = day.between_time('09:30', end, inclusive='left')
+            np.testing.assert_equal([row[f"or{window}_low"], row[f"or{window}_high"]], [window_df['Low'].min(), window_df['High'].max()])
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade_screenshots import benchmark, instrument, utils, utils_ta
+
+
+TA = ['EMA10', 'EMA20', 'VWAP', 'BB']
+
+
+def write_bars(path, df, mtime_ns):
+    benchmark.write_alpaca_json(df, utils.bars_path('alpaca-file', benchmark.SYMBOL, '1min', str(path)))
+    # Distinct mtimes so the bar cache sees each rewrite
+    os.utime(utils.bars_path('alpaca-file', benchmark.SYMBOL, '1min', str(path)), ns=(mtime_ns, mtime_ns))
+
+
+def load(path):
+    return utils.get_dataframe('alpaca-file', benchmark.SYMBOL, '', '', '1min', path=str(path))
+
+
+def assert_same_ta(result, expected, columns):
+    for col in columns:
+        np.testing.assert_allclose(result[col].to_numpy(), expected[col].to_numpy(), rtol=1e-9, equal_nan=True)
+
+
+def test_add_ta_cached_recomputes_adjusted_history(tmp_path):
+    bars = benchmark.synthetic_bars(years=0.05)
+    write_bars(tmp_path, bars, 10**18)
+    utils_ta.add_ta_cached(benchmark.SYMBOL, load(tmp_path), TA, '09:30', '16:00')
+
+    # Same timestamps, 2:1 split adjusted prices
+    adjusted = bars.copy()
+    adjusted[['Open', 'High', 'Low', 'Close']] /= 2
+    adjusted['Volume'] *= 2
+    write_bars(tmp_path, adjusted, 2 * 10**18)
+    df = load(tmp_path)
+    result = utils_ta.add_ta_cached(benchmark.SYMBOL, df, TA, '09:30', '16:00')
+    assert_same_ta(result, utils_ta.add_ta(benchmark.SYMBOL, df, TA, '09:30', '16:00'), ['EMA10', 'EMA20', 'VWAP', 'BB_UPPER', 'BB_LOWER'])
+
+
+def test_add_ta_cached_continues_appended_bars(tmp_path):
+    bars = benchmark.synthetic_bars(years=0.05)
+    half = len(bars) // 2
+    write_bars(tmp_path, bars.iloc[:half], 10**18)
+    utils_ta.add_ta_cached(benchmark.SYMBOL, load(tmp_path), TA, '09:30', '16:00')
+
+    write_bars(tmp_path, bars, 2 * 10**18)
+    df = load(tmp_path)
+    instrument.snapshot()
+    result = utils_ta.add_ta_cached(benchmark.SYMBOL, df, TA, '09:30', '16:00')
+    assert instrument.snapshot()['counters'].get('ta_cache.hit') == len(TA)
+    assert_same_ta(result, utils_ta.add_ta(benchmark.SYMBOL, df, TA, '09:30', '16:00'), ['EMA10', 'EMA20', 'VWAP', 'BB_UPPER', 'BB_LOWER'])
+
+
+@pytest.mark.parametrize('times', [('', ''), ('09:30', '16:00')])
+def test_add_ta_windows_matches_add_ta(times):
+    df = benchmark.synthetic_bars(years=0.1)
+    days = df.index.normalize().unique()
+    windows = [(days[i] + pd.Timedelta('09:30:00'), days[i + 2]) for i in (5, 12, 20)]
+    ta = ['EMA10', 'EMA20', 'EMA50', 'BB', 'VWAP']
+    result = utils_ta.add_ta_windows(benchmark.SYMBOL, df, ta, windows, *times)
+    expected = utils_ta.add_ta(benchmark.SYMBOL, df, ta, *times)
+
+    rows = np.zeros(len(df), dtype=bool)
+    for start, end in windows:
+        rows |= (df.index >= start) & (df.index < end)
+    if times[0]:
+        rows &= utils_ta.time_mask(df.index, *times)
+    assert_same_ta(result[rows], expected[rows], ['BB_UPPER', 'BB_LOWER', 'VWAP'])
+    # EMAs within the documented tolerance of add_ta_windows
+    close_range = df['Close'].max() - df['Close'].min()
+    for period in (10, 20, 50):
+        tolerance = (1 - 2 / (period + 1)) ** (3 * period) * close_range
+        np.testing.assert_allclose(result[f"EMA{period}"].to_numpy()[rows], expected[f"EMA{period}"].to_numpy()[rows], rtol=0, atol=tolerance)
+
+
+def test_vwap_mid_of_all_days_match_each_day():
+    df = benchmark.synthetic_bars(years=0.02)
+    result = utils_ta.mid(utils_ta.vwap(df.copy(), '09:30', '16:00'), '09:30', '16:00')
+    sessions = utils.sessions(df, '09:30', '16:00')
+    for start, end in zip(sessions.rth_start, sessions.rth_end):
+        # The day chart's RTH bars on their own
+        day = utils_ta.mid(utils_ta.vwap(df.iloc[start:end].copy()))
+        assert_same_ta(result.iloc[start:end], day, ['VWAP', 'Mid'])
+    assert result['Mid'][~utils_ta.time_mask(df.index, '09:30', '16:00')].isna().all()
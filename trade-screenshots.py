@@ -24,7 +24,14 @@ def main(
     filetype="png",
     outdir='',    
     days=3,
-    transform=''
+    transform='',
+    renderer='plotly',
+    force=False,
+    renderers=0,
+    render_mode='thread',
+    report='',
+    profile='',
+    profiler='cprofile'
 ):
     """
     This function generates trade screenshots for a given set of symbols and timeframes.
@@ -39,6 +46,13 @@ def main(
     :param outdir: The output directory for the generated trade screenshots.
     :param days: The number of days for which to generate trade screenshots, 0 for all available data.
     :param transform: Transform the original OHLC data into this timeframe
+    :param renderer: Image backend, 'plotly' (Kaleido) or 'matplotlib'
+    :param force: Recreate all charts, also those unchanged since the last run (see '<outdir>/manifest.json')
+    :param renderers: Number of image export threads (or processes), 0 to export the images while creating the charts
+    :param render_mode: 'thread' for export threads in each process, 'process' for export processes
+    :param report: Write a JSON report of the run (per stage/symbol/chart timings, cache hit rates, peak RSS) to this file
+    :param profile: Write profiles (per symbol, or of the whole trades run) to this directory
+    :param profiler: 'cprofile' or 'pyinstrument' (if installed)
     """
     
     bardata_path = path if path else PATHS[provider]
@@ -51,13 +65,15 @@ def main(
     if symbols:
         if end:
             # TODO: update to user Plotter etc similar to SIP handler
-            create_charts(symbols, start, end, timeframe, provider, outdir, bardata_path)
+            create_charts(symbols, start, end, timeframe, provider, outdir, bardata_path, force=force)
         else:
             # TODO: update to user Plotter etc similar to SIP handler
-            create_charts_day_by_day(start, end, timeframe, provider, symbols, filetype, outdir, days, start_time, end_time, PATHS)
+            create_charts_day_by_day(start, end, timeframe, provider, symbols, filetype, outdir, days, start_time, end_time, PATHS, renderer=renderer, force=force,
+                                     renderers=renderers, render_mode=render_mode, report=report, profile=profile, profiler=profiler)
     elif trades_file:
         # TODO: update to user Plotter etc similar to SIP handler
-        handle_trades(start, timeframe, transform, provider, trades_file, filetype, outdir, days, start_time, end_time, PATHS)         
+        handle_trades(start, timeframe, transform, provider, trades_file, filetype, outdir, days, start_time, end_time, PATHS, renderer=renderer, force=force,
+                      renderers=renderers, render_mode=render_mode, report=report, profile=profile, profiler=profiler)
     else:
         raise ValueError("symbols, trades_file, or sip_file must be provided")
 
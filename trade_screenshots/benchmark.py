@@ -0,0 +1,251 @@
+from datetime import datetime
+import importlib.util
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from trade_screenshots import render
+from trade_screenshots.plotter import Plotter
+import trade_screenshots.utils as utils
+import trade_screenshots.utils_ta as utils_ta
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stages or their inputs change, baselines of another version are not compared
+BENCHMARK_VERSION = 1
+# A stage is a regression if it takes this fraction longer than its baseline
+DEFAULT_TOLERANCE = 0.25
+SYMBOL = 'SYN'
+TA = ['EMA10', 'EMA20', 'EMA50', 'VWAP', 'BB']
+CHART_TIMEFRAME = '5min'
+IMAGE_SIZE = (1600, 900)
+# Stages in run order, see run()
+STAGES = ['load-tv', 'load-tv-cached', 'load-alpaca-file', 'load-alpaca-file-cached', 'transform', 'ta', 'split', 'levels',
+          'intraday-chart', 'daily-chart', 'export-plotly', 'export-matplotlib']
+# Module each renderer needs for the export stages
+RENDERER_MODULES = {'plotly': 'kaleido', 'matplotlib': 'matplotlib'}
+
+
+def synthetic_bars(years: float = 1.0, timeframe: str = '1min', eth: bool = True, gap_fraction: float = 0.02, holiday_fraction: float = 0.02,
+                   start: str = '2020-01-02', seed: int = 0, symbol: str = SYMBOL) -> pd.DataFrame:
+    """
+    Random walk OHLCV bars of 'timeframe' (intraday) for 'years' of weekdays in market time, 04:00-20:00 with 'eth'
+    otherwise 09:30-16:00. 'holiday_fraction' of the days and 'gap_fraction' of the remaining bars are missing, like the
+    holidays and bars without trades of real data.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = utils.timeframe_minutes(timeframe)
+    if not minutes:
+        raise ValueError(f"Intraday timeframe expected, got '{timeframe}'")
+    days = pd.bdate_range(start, periods=max(int(252 * years), 1)).as_unit('ns').asi8
+    days = days[rng.random(len(days)) >= holiday_fraction]
+    first, last = ('04:00', '20:00') if eth else ('09:30', '16:00')
+    offsets = np.arange(utils.time_of_day_ns(first), utils.time_of_day_ns(last), minutes * utils.NS_PER_MINUTE)
+    times = (days[:, None] + offsets[None, :]).ravel()
+    times = times[rng.random(len(times)) >= gap_fraction]
+
+    n = len(times)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001 * np.sqrt(minutes), n)))
+    open_ = np.concatenate(([100.0], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.0005 * np.sqrt(minutes), (2, n))) * close
+    rth = utils_ta.time_mask(pd.DatetimeIndex(times.view('datetime64[ns]')), '09:30', '16:00')
+    df = pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread[0],
+        'Low': np.minimum(open_, close) - spread[1],
+        'Close': close,
+        'Volume': np.round(rng.lognormal(7, 1, n) * np.where(rth, 1.0, 0.1) * minutes),
+    }, index=pd.DatetimeIndex(times.view('datetime64[ns]'), name='DateTime'))
+    df.attrs = {'symbol': symbol, 'timeframe': timeframe}
+    return df
+
+
+def write_tv_csv(df: pd.DataFrame, path: str, tz: str = 'America/New_York') -> None:
+    """
+    Write 'df' (in 'tz' market time) as a TradingView export, see utils.read_tv_csv
+    """
+    utc = pd.DatetimeIndex(df.index).tz_localize(tz).tz_convert('UTC').tz_localize(None)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({
+        'time': utc.as_unit('s').asi8,
+        'open': df['Open'].to_numpy(),
+        'high': df['High'].to_numpy(),
+        'low': df['Low'].to_numpy(),
+        'close': df['Close'].to_numpy(),
+        'Volume': df['Volume'].to_numpy(),
+    }).to_csv(path, index=False)
+
+
+def write_alpaca_json(df: pd.DataFrame, path: str, symbol: str = SYMBOL, tz: str = 'America/New_York') -> None:
+    """
+    Write 'df' (in 'tz' market time) as an alpaca-file bar file, see utils.stream_json_dataframe
+    """
+    dates = pd.DatetimeIndex(df.index).tz_localize(tz).tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+    bars = [dict(DateTime=date, Open=o, High=h, Low=l, Close=c, Volume=v)
+            for date, o, h, l, c, v in zip(dates, *(df[col].tolist() for col in utils.JSON_COLUMNS))]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({symbol: bars}, f)
+
+
+def timed(fun: Callable[[], Any], repeat: int = 3) -> Tuple[float, Any]:
+    """
+    Best wall time of 'repeat' calls of 'fun' and the result of the last one
+    """
+    best = float('inf')
+    result = None
+    for _ in range(max(repeat, 1)):
+        t = time.perf_counter()
+        result = fun()
+        best = min(best, time.perf_counter() - t)
+    return best, result
+
+
+def _result(seconds: float, items: int, unit: str) -> Dict[str, Any]:
+    return {'seconds': seconds, 'items': items, 'unit': unit, 'per_sec': items / seconds if seconds > 0 else float('inf')}
+
+
+def run(years: float = 1.0, charts: int = 10, repeat: int = 3, stages: Optional[List[str]] = None, workdir: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Time the STAGES (or the subset 'stages') on synthetic_bars() of 'years', the chart stages on 'charts' charts.
+    The bar files, caches and images are written to 'workdir' (a removed temporary directory by default).
+
+    Returns per stage its best time of 'repeat' runs, the number of bars or charts and their rate.
+    """
+    stages = stages or STAGES
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}, expected some of {STAGES}")
+    directory = workdir or tempfile.mkdtemp(prefix='trade_screenshots-benchmark-')
+    results = {}
+
+    def stage(name: str, fun: Callable[[], Any], items: int, unit: str) -> None:
+        if name in stages:
+            seconds, _ = timed(fun, repeat)
+            results[name] = _result(seconds, items, unit)
+            print(f"{name}: {seconds:.4f}s ({results[name]['per_sec']:.1f} {unit}/sec)")
+
+    try:
+        print(f"Generating {years} years of 1min bars")
+        df = synthetic_bars(years)
+        bars = len(df)
+        paths = {'tv': directory, 'alpaca-file': directory}
+        if any(name.startswith('load-') for name in stages):
+            write_tv_csv(df, utils.bars_path('tv', SYMBOL, '1min', directory))
+            write_alpaca_json(df, utils.bars_path('alpaca-file', SYMBOL, '1min', directory))
+        for provider in ('tv', 'alpaca-file'):
+            stage(f"load-{provider}", lambda: utils.get_dataframe(provider, SYMBOL, '', '', '1min', path=paths[provider], use_cache=False), bars, 'bars')
+            if f"load-{provider}-cached" in stages:
+                # Build the cache, then time the memory mapped reads of the chart handlers
+                utils.get_dataframe(provider, SYMBOL, '', '', '1min', path=paths[provider])
+            stage(f"load-{provider}-cached", lambda: utils.get_dataframe(provider, SYMBOL, '', '', '1min', path=paths[provider], copy=False), bars, 'bars')
+
+        stage('transform', lambda: utils.transform_timeframe(df, '1min', CHART_TIMEFRAME), bars, 'bars')
+        stage('ta', lambda: utils_ta.add_ta(SYMBOL, df, TA, '09:30', '16:00'), bars, 'bars')
+        stage('split', lambda: utils.split(df, '09:30', '16:00', {}), bars, 'bars')
+        stage('levels', lambda: utils.levels_table(df), bars, 'bars')
+
+        # Charts of the last days as in the SIP handler, two days of bars with indicators and levels
+        chart_df = utils_ta.add_ta(SYMBOL, utils.transform_timeframe(df, '1min', CHART_TIMEFRAME), ['EMA10', 'VWAP'], '09:30', '16:00')
+        levels = utils.levels_table(df)
+        dates = levels.index[-charts - 1:]
+        chart_dfs = [chart_df.loc[f"{a.date()}":f"{b.date()} 23:59"] for a, b in zip(dates[:-1], dates[1:])]
+        daily_df = utils.transform_timeframe(df, '1min', 'day')
+
+        def intraday_charts(plotter):
+            return [plotter.intraday_chart(day_df, CHART_TIMEFRAME, SYMBOL, f"{SYMBOL} {day_df.index[0].date()}",
+                                           levels=utils.day_levels(levels, day_df.index[0], ['yday_mid', 'today_mid', 'or30_high', 'or30_low']),
+                                           ta_indicators=['EMA10', 'VWAP'])
+                    for day_df in chart_dfs]
+
+        def daily_charts(plotter):
+            return [plotter.daily_chart(daily_df.loc[:f"{date.date()}"].iloc[-250:], SYMBOL, f"{SYMBOL} {date.date()}") for date in dates[1:]]
+
+        # The figure templates are built by the first chart of a Plotter, the stages time the charts after it
+        plotter = Plotter(fast=True)
+        intraday_charts(plotter)
+        daily_charts(plotter)
+        stage('intraday-chart', lambda: intraday_charts(plotter), len(chart_dfs), 'charts')
+        stage('daily-chart', lambda: daily_charts(plotter), len(chart_dfs), 'charts')
+
+        for renderer in render.RENDERERS:
+            if f"export-{renderer}" not in stages:
+                continue
+            if importlib.util.find_spec(RENDERER_MODULES[renderer]) is None:
+                print(f"export-{renderer}: skipped, '{RENDERER_MODULES[renderer]}' is not installed")
+                continue
+            figures = intraday_charts(Plotter(fast=True, renderer=renderer))
+            image_dir = os.path.join(directory, 'images', renderer)
+            # Untimed first image, e.g. starting Kaleido
+            utils.write_file(figures[0], os.path.join(image_dir, 'warmup'), *IMAGE_SIZE, renderer=renderer)
+            stage(f"export-{renderer}", lambda: [utils.write_file(fig, os.path.join(image_dir, str(i)), *IMAGE_SIZE, renderer=renderer)
+                                                 for i, fig in enumerate(figures)], len(figures), 'charts')
+    finally:
+        if workdir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def environment() -> Dict[str, str]:
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'cpus': str(os.cpu_count()), 'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, Any]], params: Dict[str, Any]) -> None:
+    """
+    Store 'results' of run('params') as the baseline in 'path'. Stages missing in 'results' keep their previous baseline.
+    """
+    baseline = load_baseline(path)
+    previous = baseline['results'] if baseline is not None and baseline['params'] == params else {}
+    with open(path, 'w') as f:
+        json.dump({'version': BENCHMARK_VERSION, 'created': datetime.now().isoformat(timespec='seconds'), 'environment': environment(),
+                   'params': params, 'results': {**previous, **results}}, f, indent=1, sort_keys=True)
+
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    """
+    The baseline stored in 'path', None if missing or of another BENCHMARK_VERSION
+    """
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if baseline.get('version') != BENCHMARK_VERSION:
+        logger.warning(f"Ignoring baseline '{path}' of version {baseline.get('version')}, expected {BENCHMARK_VERSION}")
+        return None
+    return baseline
+
+
+def regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Stages of 'results' more than 'tolerance' slower than in 'baseline'
+    """
+    return [name for name, result in results.items()
+            if name in baseline['results'] and result['seconds'] > baseline['results'][name]['seconds'] * (1 + tolerance)]
+
+
+def report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None, tolerance: float = DEFAULT_TOLERANCE) -> str:
+    """
+    Table of the stage timings and rates, with the change against 'baseline' and the regressions flagged
+    """
+    slower = regressions(results, baseline, tolerance) if baseline is not None else []
+    lines = [f"{'stage':<26}{'seconds':>10}{'rate':>22}{'baseline':>12}{'change':>9}"]
+    for name, result in results.items():
+        line = f"{name:<26}{result['seconds']:>10.4f}{result['per_sec']:>14.1f} {result['unit'] + '/s':>7}"
+        if baseline is not None and name in baseline['results']:
+            previous = baseline['results'][name]['seconds']
+            line += f"{previous:>12.4f}{(result['seconds'] / previous - 1) * 100:>+8.0f}%"
+            if name in slower:
+                line += '  REGRESSION'
+        lines.append(line)
+    return '\n'.join(lines)
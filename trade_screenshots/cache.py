@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from trade_screenshots import instrument
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so stale caches are rebuilt
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache'
+META_FILE = 'meta.json'
+INDEX_FILE = 'DateTime.npy'
+STATES_FILE = 'states.json'
+
+
+def cache_dir(source_path: str, variant: str = '') -> str:
+    """
+    Directory holding the converted columns for 'source_path', e.g. '1min/AAPL.json' -> '1min/AAPL.json.cache/'.
+    'variant' separates different conversions of the same source, e.g. a subset of its columns.
+    """
+    return f"{source_path}.{variant}{CACHE_SUFFIX}" if variant else f"{source_path}{CACHE_SUFFIX}"
+
+
+def source_key(source_path: str) -> Dict[str, int]:
+    st = os.stat(source_path)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def read_meta(source_path: str, variant: str = '') -> Optional[Dict]:
+    """
+    Returns the cache meta data if the cache exists and was built from the current version of 'source_path'
+    """
+    meta_path = os.path.join(cache_dir(source_path, variant), META_FILE)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION or meta.get('source') != source_key(source_path):
+            logger.debug(f"Stale cache '{meta_path}'")
+            return None
+        return meta
+    except (OSError, ValueError):
+        return None
+
+
+def _column_file(column: str) -> str:
+    return f"col_{column}.npy"
+
+
+def row_range(index: np.ndarray, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> Tuple[int, int]:
+    """
+    Row positions [lo, hi) of the sorted int64 'index' within [start, end), end being exclusive
+    """
+    lo = int(np.searchsorted(index, pd.Timestamp(start).as_unit('ns').value, side='left')) if start is not None else 0
+    hi = int(np.searchsorted(index, pd.Timestamp(end).as_unit('ns').value, side='left')) if end is not None else len(index)
+    return lo, max(lo, hi)
+
+
+def _read_columns(directory: str, meta: Dict, start: Optional[pd.Timestamp], end: Optional[pd.Timestamp], copy: bool) -> Optional[pd.DataFrame]:
+    # Columns are memory mapped so only the requested row range is read from disk. Without 'copy' the frame's columns
+    # are (read only) views of the mapped files, shared through the page cache by all processes reading them.
+    try:
+        index = np.load(os.path.join(directory, INDEX_FILE), mmap_mode='r')
+        lo, hi = row_range(index, start, end)
+        columns = {col: np.load(os.path.join(directory, _column_file(col)), mmap_mode='r')[lo:hi] for col in meta['columns']}
+        index = index[lo:hi]
+        if copy:
+            index = np.array(index)
+            columns = {col: np.array(values) for col, values in columns.items()}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Error reading cache '{directory}': {e}")
+        return None
+    df = pd.DataFrame(columns, index=pd.DatetimeIndex(index.view('datetime64[ns]'), name=meta['index_name']), columns=meta['columns'],
+                      copy=False)
+    df.attrs = dict(meta['attrs'])
+    logger.debug(f"Loaded {len(df)} rows from cache '{directory}'")
+    return df
+
+
+def load(source_path: str, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None, variant: str = '',
+         copy: bool = True) -> Optional[pd.DataFrame]:
+    """
+    Load the cached rows within [start, end). Without 'copy' the columns are read only memory mapped views.
+    """
+    meta = read_meta(source_path, variant)
+    if meta is None:
+        return None
+    return _read_columns(cache_dir(source_path, variant), meta, start, end, copy)
+
+
+def _save_array(path: str, arr: np.ndarray) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def _write_columns(directory: str, df: pd.DataFrame, meta: Dict) -> bool:
+    # One .npy file per column and the sorted int64 index. The meta file is written last so a partially written
+    # directory is never considered valid.
+    non_numeric = [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])]
+    if non_numeric:
+        logger.debug(f"Not caching '{directory}', non-numeric columns: {non_numeric}")
+        return False
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        index = pd.DatetimeIndex(df.index).as_unit('ns')
+        _save_array(os.path.join(directory, INDEX_FILE), index.asi8)
+        for col in df.columns:
+            _save_array(os.path.join(directory, _column_file(col)), df[col].to_numpy())
+        meta = {
+            **meta,
+            'version': CACHE_VERSION,
+            'columns': [str(col) for col in df.columns],
+            'index_name': df.index.name,
+            'attrs': df.attrs,
+            'rows': len(df),
+        }
+        tmp_path = os.path.join(directory, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, META_FILE))
+    except OSError as e:
+        logger.warning(f"Error writing cache '{directory}': {e}")
+        return False
+    logger.debug(f"Wrote {len(df)} rows to cache '{directory}'")
+    return True
+
+
+def store(source_path: str, df: pd.DataFrame, variant: str = '') -> bool:
+    """
+    Write 'df' as one .npy file per column next to 'source_path'
+    """
+    try:
+        key = source_key(source_path)
+    except OSError as e:
+        logger.warning(f"Error writing cache for '{source_path}': {e}")
+        return False
+    return _write_columns(cache_dir(source_path, variant), df, {'source': key})
+
+
+def cached(source_path: str, loader: Callable[[], pd.DataFrame], start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None,
+           variant: str = '', copy: bool = True) -> pd.DataFrame:
+    """
+    Return the cached rows of 'source_path' within [start, end), or call 'loader' and cache its (full) result if the cache
+    is missing or stale. Without 'copy' cached rows are returned as read only memory mapped views.
+    """
+    df = load(source_path, start, end, variant, copy)
+    if df is not None:
+        instrument.count('bars_cache.hit')
+        return df
+    instrument.count('bars_cache.miss')
+    df = loader()
+    if df is not None and not df.empty:
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        store(source_path, df, variant)
+        if start is not None or end is not None:
+            lo, hi = row_range(pd.DatetimeIndex(df.index).as_unit('ns').asi8, start, end)
+            df = df.iloc[lo:hi]
+    return df
+
+
+class BarsRef(NamedTuple):
+    """
+    Descriptor of the bars within [start, end) of a bar store directory, see store_bars(). Returned by pool workers
+    instead of the (pickled) frame.
+    """
+    directory: str
+    start: Optional[pd.Timestamp] = None
+    end: Optional[pd.Timestamp] = None
+
+
+def store_bars(directory: str, df: pd.DataFrame) -> Optional[BarsRef]:
+    """
+    Write 'df' (e.g. transformed bars without a source file of their own) in the cache layout to 'directory'
+    """
+    return BarsRef(directory) if _write_columns(directory, df, {}) else None
+
+
+def open_bars(ref: BarsRef, copy: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Open the bars of 'ref', by default as read only views of the memory mapped columns
+    """
+    try:
+        with open(os.path.join(ref.directory, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Error reading bar store '{ref.directory}': {e}")
+        return None
+    return _read_columns(ref.directory, meta, ref.start, ref.end, copy)
+
+
+def levels_cache_dir(source_path: str, group: str) -> str:
+    """
+    Directory of the levels table 'group' (e.g. timeframe and session times) stored with the bar cache of 'source_path'
+    """
+    return os.path.join(cache_dir(source_path), 'levels', group)
+
+
+def cached_table(directory: str, source_path: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Return the table (a frame with a datetime index) cached in 'directory', or call 'loader' and cache its result if the
+    cache is missing or was built from another version of 'source_path'
+    """
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') == CACHE_VERSION and meta.get('source') == source_key(source_path):
+            df = _read_columns(directory, meta, None, None, copy=True)
+            if df is not None:
+                instrument.count('levels_cache.hit')
+                return df
+    except (OSError, ValueError):
+        pass
+    instrument.count('levels_cache.miss')
+    df = loader()
+    if not df.empty:
+        try:
+            _write_columns(directory, df, {'source': source_key(source_path)})
+        except OSError as e:
+            logger.warning(f"Error writing cache '{directory}': {e}")
+    return df
+
+
+def ta_cache_dir(source_path: str, group: str) -> str:
+    """
+    Directory of the indicator cache 'group' (e.g. timeframe and session times) stored with the bar cache of 'source_path'
+    """
+    return os.path.join(cache_dir(source_path), 'ta', group)
+
+
+def load_ta(directory: str) -> Optional[Tuple[np.ndarray, Dict[str, Dict]]]:
+    """
+    Returns the (memory mapped) int64 index the cached indicators were computed for and the per indicator states.
+    Each state has 'rows', the number of leading index rows its column covers.
+    """
+    try:
+        with open(os.path.join(directory, STATES_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION:
+            return None
+        return np.load(os.path.join(directory, INDEX_FILE), mmap_mode='r'), meta['states']
+    except (OSError, ValueError):
+        return None
+
+
+def load_ta_column(directory: str, column: str) -> np.ndarray:
+    return np.load(os.path.join(directory, _column_file(column)), mmap_mode='r')
+
+
+def store_ta(directory: str, index: np.ndarray, columns: Dict[str, np.ndarray], states: Dict[str, Dict]) -> bool:
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _save_array(os.path.join(directory, INDEX_FILE), index)
+        for column, values in columns.items():
+            _save_array(os.path.join(directory, _column_file(column)), values)
+        tmp_path = os.path.join(directory, f"{STATES_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'states': states}, f)
+        os.replace(tmp_path, os.path.join(directory, STATES_FILE))
+    except OSError as e:
+        logger.warning(f"Error writing indicator cache '{directory}': {e}")
+        return False
+    return True
+
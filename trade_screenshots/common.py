@@ -5,7 +5,7 @@ VALID_TIME_FRAMES = ['1min', '2min', '3min', '5min', '15min', '30min', '60min']
 
 def try_process_symbol(fun, symbol):
     try:
-        fun(symbol)
+        return fun(symbol)
     except Exception as e:
         print(f"Error processing symbol {symbol}: {e}. Skipping.")
         traceback.print_exc()
@@ -0,0 +1,237 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import cProfile
+from datetime import datetime
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+# 'cprofile' (standard library) or 'pyinstrument' (optional dependency)
+PROFILERS = ['cprofile', 'pyinstrument']
+
+# Timers and counters of this process since the last snapshot(), also updated by the RenderPool threads
+_lock = threading.Lock()
+_stages: Dict[str, Dict[str, float]] = {}
+_symbols: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+_charts: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+_counters: Dict[str, int] = defaultdict(int)
+_failed: List[str] = []
+
+
+def add_time(stage: str, seconds: float, symbol: Optional[str] = None, chart: Optional[str] = None) -> None:
+    with _lock:
+        totals = _stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+        totals['count'] += 1
+        totals['seconds'] += seconds
+        totals['max'] = max(totals['max'], seconds)
+        if symbol is not None:
+            _symbols[symbol][stage] += seconds
+        if chart is not None:
+            _charts[chart][stage] += seconds
+
+
+@contextmanager
+def timer(stage: str, symbol: Optional[str] = None, chart: Optional[str] = None):
+    """
+    Add the time spent in the block to the totals of 'stage' (e.g. 'load', 'ta', 'figure', 'export'), and to those of
+    'symbol' and 'chart' (manifest key) if given
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start, symbol, chart)
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Increment counter 'name'. Counters '<cache>.hit' and '<cache>.miss' are reported as the hit rate of '<cache>'.
+    """
+    with _lock:
+        _counters[name] += n
+
+
+def export_failed(path: str) -> None:
+    """
+    Record an image that could not be written, reported by RunReport
+    """
+    with _lock:
+        _failed.append(path)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB, None if not available
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == 'darwin' else rss / 1024
+
+
+def snapshot(reset: bool = True) -> Dict[str, Any]:
+    """
+    Timers and counters of this process (and its peak RSS), cleared with 'reset' so the next snapshot only has the
+    work done after this one
+    """
+    with _lock:
+        data = {
+            'pid': os.getpid(),
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': {stage: dict(totals) for stage, totals in _stages.items()},
+            'symbols': {symbol: dict(stages) for symbol, stages in _symbols.items()},
+            'charts': {chart: dict(stages) for chart, stages in _charts.items()},
+            'counters': dict(_counters),
+            'failed': list(_failed),
+        }
+        if reset:
+            _stages.clear()
+            _symbols.clear()
+            _charts.clear()
+            _counters.clear()
+            _failed.clear()
+    return data
+
+
+@contextmanager
+def profiled(path: str, profiler: str = 'cprofile'):
+    """
+    Profile the block and write the profile to '<path>.prof' (cProfile, e.g. for snakeviz) or '<path>.html' (pyinstrument)
+    """
+    if profiler == 'pyinstrument' and importlib.util.find_spec('pyinstrument') is None:
+        logger.warning("pyinstrument not installed, using cProfile")
+        profiler = 'cprofile'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(f"{path}.html", 'w') as f:
+                f.write(prof.output_html())
+    else:
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(f"{path}.prof")
+
+
+def collected(func: Callable, profile_dir: str, profiler: str, *args) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Call func(*args) and return its result with the snapshot() of this process, i.e. the work of the task (and of the
+    export threads since the previous one). Used to run the tasks of pool workers, whose timers and counters are
+    otherwise lost with the process. With 'profile_dir' the task is profiled to '<profile_dir>/<args[0]>-<pid>' (args[0]
+    being the symbol).
+    """
+    with profiled(os.path.join(profile_dir, f"{args[0]}-{os.getpid()}"), profiler) if profile_dir else nullcontext():
+        result = func(*args)
+    return result, snapshot()
+
+
+class RunReport:
+    """
+    Report of a run merged from the snapshot() of each task (and of the main process), written as JSON by save().
+    Stage times are summed over all processes and threads, so with workers they exceed the wall time.
+    """
+    def __init__(self, path: str, **params: Any):
+        self.path = path
+        self.params = params
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.snapshots: List[Dict[str, Any]] = []
+        # Drop whatever was timed in this process before the run
+        snapshot()
+
+    def add(self, data: Dict[str, Any]) -> None:
+        self.snapshots.append(data)
+
+    def data(self) -> Dict[str, Any]:
+        stages: Dict[str, Dict[str, float]] = {}
+        symbols: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        charts: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        counters: Dict[str, int] = defaultdict(int)
+        failed: List[str] = []
+        workers: Dict[int, Dict[str, Any]] = {}
+        # The snapshots of the tasks, and the work of the main process outside of them
+        for task, data in [*((True, data) for data in self.snapshots), (False, snapshot(reset=False))]:
+            for stage, totals in data['stages'].items():
+                merged = stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+                merged['count'] += totals['count']
+                merged['seconds'] += totals['seconds']
+                merged['max'] = max(merged['max'], totals['max'])
+            for target, source in ((symbols, data['symbols']), (charts, data['charts'])):
+                for key, times in source.items():
+                    for stage, seconds in times.items():
+                        target[key][stage] += seconds
+            for name, n in data['counters'].items():
+                counters[name] += n
+            failed.extend(data['failed'])
+            worker = workers.setdefault(data['pid'], {'tasks': 0, 'peak_rss_mb': None})
+            worker['tasks'] += task
+            if data['peak_rss_mb'] is not None:
+                worker['peak_rss_mb'] = max(worker['peak_rss_mb'] or 0.0, data['peak_rss_mb'])
+
+        hit_rates = {}
+        for name in sorted({name.rsplit('.', 1)[0] for name in counters if name.endswith(('.hit', '.miss'))}):
+            hits, misses = counters.get(f"{name}.hit", 0), counters.get(f"{name}.miss", 0)
+            hit_rates[name] = {'hits': hits, 'misses': misses, 'rate': hits / (hits + misses) if hits + misses else None}
+        return {
+            'version': REPORT_VERSION,
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': time.perf_counter() - self.start,
+            'params': self.params,
+            'stages': stages,
+            'symbols': {symbol: {**times, 'total': sum(times.values())} for symbol, times in symbols.items()},
+            'charts': {chart: dict(times) for chart, times in charts.items()},
+            'counters': dict(counters),
+            'cache_hit_rates': hit_rates,
+            'failed_exports': sorted(failed),
+            'workers': {str(pid): worker for pid, worker in workers.items()},
+        }
+
+    def save(self) -> Dict[str, Any]:
+        data = self.data()
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(data, f, indent=1, sort_keys=True, default=str)
+            print(f"Wrote run report '{self.path}'")
+        return data
+
+
+def summary(data: Dict[str, Any]) -> str:
+    """
+    Short text version of a RunReport, the stages by total time
+    """
+    stages = sorted(data['stages'].items(), key=lambda item: -item[1]['seconds'])
+    lines = [f"Run time {data['wall_seconds']:.1f}s, stage times: " +
+             ', '.join(f"{stage} {totals['seconds']:.2f}s ({totals['count']}x)" for stage, totals in stages)]
+    if data['cache_hit_rates']:
+        lines.append('Cache hit rates: ' + ', '.join(f"{name} {rate['hits']}/{rate['hits'] + rate['misses']}" for name, rate in data['cache_hit_rates'].items()))
+    if data['failed_exports']:
+        lines.append(f"Failed to export {len(data['failed_exports'])} charts: " + ', '.join(data['failed_exports']))
+    rss = [worker['peak_rss_mb'] for worker in data['workers'].values() if worker['peak_rss_mb'] is not None]
+    if rss:
+        lines.append(f"Peak RSS {max(rss):.0f} MB ({len(rss)} processes)")
+    return '\n'.join(lines)
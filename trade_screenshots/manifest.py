@@ -0,0 +1,117 @@
+from functools import lru_cache
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from trade_screenshots import instrument
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the digest inputs change so all charts are rebuilt
+MANIFEST_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """
+    Hash of the package sources, so charts are rebuilt when the code drawing them changes
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                h.update(name.encode())
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def _update_frame(h, df: pd.DataFrame) -> None:
+    h.update(np.ascontiguousarray(pd.DatetimeIndex(df.index).as_unit('ns').asi8).tobytes())
+    for col in df.columns:
+        h.update(str(col).encode())
+        h.update(np.ascontiguousarray(df[col].to_numpy()).tobytes())
+
+
+def chart_digest(df: Optional[pd.DataFrame], **inputs: Any) -> str:
+    """
+    Content hash of the bars 'df' of a chart and its other 'inputs' (indicators, levels, title, plot config etc.)
+    """
+    h = hashlib.sha1()
+    h.update(f"{MANIFEST_VERSION}:{code_version()}".encode())
+    h.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+    if df is not None:
+        _update_frame(h, df)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Input digests of the charts written to 'outdir', stored in '<outdir>/manifest.json'. Charts whose digest is unchanged
+    (and whose image exists) are skipped unless 'force'.
+
+    Entries of new charts are collected by the caller, e.g. returned by the pool workers, and added with update()
+    before save(). The manifest itself is only read by the workers. Entries of charts exported by a RenderPool are
+    recorded when submitted and discard()ed if the export fails.
+    """
+    def __init__(self, outdir: str, force: bool = False):
+        self.outdir = outdir or '.'
+        self.path = os.path.join(self.outdir, MANIFEST_FILE)
+        self.force = force
+        self.entries: Dict[str, str] = {} if force else self._read()
+        self.updates: Dict[str, str] = {}
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data['charts'] if data.get('version') == MANIFEST_VERSION else {}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def key(self, filename: str) -> str:
+        return os.path.relpath(f"{filename}.png", self.outdir)
+
+    def is_current(self, filename: str, digest: str) -> bool:
+        """
+        True if '<filename>.png' exists and was written from inputs with 'digest'
+        """
+        current = not self.force and self.entries.get(self.key(filename)) == digest and os.path.exists(f"{filename}.png")
+        instrument.count('manifest.hit' if current else 'manifest.miss')
+        return current
+
+    def update(self, entries: Dict[str, str]) -> None:
+        self.updates.update(entries)
+
+    def discard(self, paths: Iterable[str], entries: Optional[Dict[str, str]] = None) -> None:
+        """
+        Drop the entries of the images at 'paths' (exports that failed, see render.RenderPool.failed) from 'entries',
+        default the updates of this manifest, so an older image isn't taken for the new chart by the next run
+        """
+        entries = self.updates if entries is None else entries
+        for path in paths:
+            entries.pop(os.path.relpath(path, self.outdir), None)
+
+    def save(self) -> None:
+        if not self.updates:
+            return
+        # Re-read so entries written by other runs into the same outdir since this one started are kept
+        charts = {**self._read(), **self.updates}
+        try:
+            os.makedirs(self.outdir, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'charts': charts}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Error writing manifest '{self.path}': {e}")
+            return
+        logger.debug(f"Wrote {len(self.updates)} entries to manifest '{self.path}'")
+        self.updates = {}
@@ -0,0 +1,150 @@
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+
+# Plotly defaults, so both renderers produce similar charts
+INCREASING_COLOR = '#3D9970'
+DECREASING_COLOR = '#FF4136'
+BACKGROUND_COLOR = '#E5ECF6'
+TEXT_COLOR = '#2a3f5f'
+DASHES = {'solid': '-', 'dot': ':', 'dash': '--', 'longdash': '--', 'dashdot': '-.', 'longdashdot': '-.'}
+BODY_WIDTH = 0.7
+DPI = 100
+X_TICKS = 8
+EDGE_FRACTION = 0.1
+PNG_COMPRESS_LEVEL = 1
+
+# Per thread (render.RenderPool(mode='thread')) (figure, price axes, volume axes) by image size, see _canvas()
+_local = threading.local()
+
+
+def _positions(x: np.ndarray, values: Any) -> np.ndarray:
+    # Fractional bar positions of the 'values' dates, bars are drawn at 0..n-1 which hides the gaps like plotly rangebreaks
+    values = pd.to_datetime(np.atleast_1d(values)).as_unit('ns').asi8.astype(np.float64)
+    return np.interp(values, x.astype(np.float64), np.arange(len(x), dtype=np.float64))
+
+
+def _text(text: str) -> str:
+    return re.sub(r'<br\s*/?>', '\n', str(text))
+
+
+def _vertical_lines(ax, pos: np.ndarray, y0: np.ndarray, y1: np.ndarray, color: str, width_pt: float) -> None:
+    # All segments as a single NaN separated line instead of one artist (or path) per bar
+    xs = np.repeat(pos, 3)
+    ys = np.column_stack([y0, y1, np.full(len(pos), np.nan)]).ravel()
+    xs[2::3] = np.nan
+    ax.plot(xs, ys, color=color, linewidth=width_pt, solid_capstyle='butt')
+
+
+def _draw_candles(ax, trace: Dict[str, Any], body_width_pt: float) -> None:
+    o, h, l, c = (np.asarray(trace[key], dtype=np.float64) for key in ('open', 'high', 'low', 'close'))
+    pos = np.arange(len(o), dtype=np.float64)
+    up = c >= o
+    for mask, color in ((up, INCREASING_COLOR), (~up, DECREASING_COLOR)):
+        _vertical_lines(ax, pos[mask], l[mask], h[mask], color, 1)
+        _vertical_lines(ax, pos[mask], np.minimum(o, c)[mask], np.maximum(o, c)[mask], color, body_width_pt)
+
+
+def _draw_shape(ax, shape: Dict[str, Any], x: np.ndarray) -> None:
+    x0, x1 = _positions(x, [shape['x0'], shape['x1']])
+    line = shape.get('line', {})
+    ax.plot([x0, x1], [shape['y0'], shape['y1']], color=line.get('color', TEXT_COLOR), linestyle=DASHES.get(line.get('dash', 'solid'), '-'),
+            alpha=shape.get('opacity', 1.0), linewidth=line.get('width', 2))
+
+
+def _draw_annotation(ax, annotation: Dict[str, Any], x: np.ndarray) -> None:
+    xy = (_positions(x, annotation['x'])[0], annotation['y'])
+    fontsize = annotation.get('font', {}).get('size', 12)
+    if annotation.get('showarrow', True):
+        # Plotly 'ax'/'ay' are the pixel offsets of the text from the point, 'ay' pointing down. Like plotly, keep the
+        # text of points close to the edges inside the chart.
+        offset = (annotation.get('ax', -10), -annotation.get('ay', -30))
+        edge = len(x) * EDGE_FRACTION
+        ha = 'left' if xy[0] < edge else 'right' if xy[0] > len(x) - edge else 'center'
+        ax.annotate(_text(annotation['text']), xy=xy, xytext=offset, textcoords='offset pixels', ha=ha, va='center', fontsize=fontsize,
+                    color=TEXT_COLOR, arrowprops=dict(arrowstyle='-|>', color=TEXT_COLOR, lw=annotation.get('arrowwidth', 1)))
+    else:
+        ax.annotate(_text(annotation['text']), xy=xy, ha=annotation.get('xanchor', 'center'), va='bottom', fontsize=fontsize, color=TEXT_COLOR)
+
+
+def _set_x_ticks(ax, x: np.ndarray) -> None:
+    dates = pd.DatetimeIndex(x)
+    ticks = np.unique(np.linspace(0, len(x) - 1, min(X_TICKS, len(x))).astype(int))
+    intraday = len(dates) > 1 and (dates.normalize() != dates).any()
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(dates[ticks].strftime('%b %d %H:%M' if intraday else '%b %d %Y'))
+
+
+def _canvas(width: int, height: int) -> Tuple[Figure, Any, Any]:
+    """
+    Figure and price/volume axes for 'width' x 'height' images, created once per thread and size. Creating the axes
+    (and their ticks) costs about as much as drawing a chart.
+    """
+    canvases: Dict[Tuple[int, int], Tuple[Figure, Any, Any]] = _local.__dict__.setdefault('canvases', {})
+    if (width, height) not in canvases:
+        figure = Figure(figsize=(width / DPI, height / DPI), dpi=DPI)
+        FigureCanvasAgg(figure)
+        price_ax, volume_ax = figure.subplots(2, 1, sharex=True, gridspec_kw=dict(height_ratios=[0.8, 0.2], hspace=0.02))
+        figure.subplots_adjust(left=0.05, right=0.95, top=0.89, bottom=0.1)
+        for ax in (price_ax, volume_ax):
+            ax.set_facecolor(BACKGROUND_COLOR)
+            ax.grid(color='white')
+            ax.set_axisbelow(True)
+            for spine in ax.spines.values():
+                spine.set_visible(False)
+        canvases[(width, height)] = (figure, price_ax, volume_ax)
+    return canvases[(width, height)]
+
+
+def write_image(fig: Dict[str, Any], path: str, width: int, height: int) -> None:
+    """
+    Draw a Plotter figure dict (candlestick, volume bar and indicator line traces, shapes and annotations) with the
+    matplotlib Agg canvas and write it as png to 'path'
+    """
+    traces: List[Dict[str, Any]] = fig['data']
+    layout: Dict[str, Any] = fig.get('layout', {})
+    candles = next(trace for trace in traces if trace['type'] == 'candlestick')
+    x = pd.to_datetime(np.asarray(candles['x'])).as_unit('ns').asi8
+
+    figure, price_ax, volume_ax = _canvas(width, height)
+    # Remove the previous chart
+    for ax in (price_ax, volume_ax):
+        for artist in [*ax.lines, *ax.texts]:
+            artist.remove()
+
+    if len(x):
+        bar_pixels = price_ax.get_window_extent().width / len(x)
+        body_width_pt = max(1.0, bar_pixels * BODY_WIDTH * 72 / DPI)
+        for trace in traces:
+            if trace['type'] == 'candlestick':
+                _draw_candles(price_ax, trace, body_width_pt)
+            elif trace['type'] == 'bar':
+                color = trace.get('marker', {}).get('color', 'blue')
+                y = np.asarray(trace['y'], dtype=np.float64)
+                _vertical_lines(volume_ax, _positions(x, trace['x']), np.zeros(len(y)), y, color, body_width_pt)
+            elif trace['type'] == 'scatter':
+                price_ax.plot(_positions(x, trace['x']), np.asarray(trace['y'], dtype=np.float64), color=trace.get('line', {}).get('color', 'black'),
+                              linewidth=2)
+        for shape in layout.get('shapes', []):
+            _draw_shape(price_ax, shape, x)
+        for annotation in layout.get('annotations', []):
+            _draw_annotation(price_ax, annotation, x)
+    for ax in (price_ax, volume_ax):
+        ax.relim()
+        ax.autoscale_view()
+    price_ax.set_xlim(-1, max(len(x), 1))
+    _set_x_ticks(volume_ax, x)
+
+    title = layout.get('title', {})
+    figure.suptitle(_text(title.get('text', '') if isinstance(title, dict) else title), x=0.05, ha='left', fontsize=14, color=TEXT_COLOR)
+    figure.canvas.draw()
+    # RGB with a fast zlib level, the default spends more time compressing than drawing
+    image = Image.frombuffer('RGBA', figure.canvas.get_width_height(), figure.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+    image.save(path, format='png', compress_level=PNG_COMPRESS_LEVEL)
@@ -1,10 +1,14 @@
 from functools import partial
 import logging
-from typing import Any, Dict, List, Optional
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
 import functools
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
+import numpy as np
 import pandas as pd
+from trade_screenshots import render
+import trade_screenshots.utils as utils
 import trade_screenshots.utils_ta as utils_ta
 
 
@@ -20,6 +24,9 @@ TA_PARAMS = {
     'Jlines': {'color': 'green'}
 }
 
+# Opening range level keys drawn by Plotter.intraday_chart()
+OR_LEVEL = re.compile(r'^or\d*_(high|low)$')
+
 TRADE_BARS_INCLUDED = {
     'month': (500, 200),
     'week': (250, 40),
@@ -35,6 +42,51 @@ TRADE_BARS_INCLUDED = {
 
 logger = logging.getLogger(__name__)
 
+MINUTES_PER_DAY = 24 * 60
+NS_PER_MINUTE = 60 * 10**9
+
+
+def bar_minutes(tf: str) -> int:
+    if tf.endswith('min'):
+        return int(tf[:-3])
+    if tf == 'day':
+        return MINUTES_PER_DAY
+    raise ValueError(f"Unsupported timeframe '{tf}' for rangebreaks")
+
+
+def rangebreaks(index: pd.DatetimeIndex, tf: str) -> List[Dict[str, Any]]:
+    """
+    Rangebreaks hiding the bar slots of timeframe 'tf' without data in 'index'.
+
+    Weekends and the hours outside the traded session are expressed as 'bounds' patterns, so only the
+    remaining gaps (e.g. holidays, halts) are listed explicitly. Gaps are found on the int64 timestamps
+    instead of comparing formatted strings against the index.
+    """
+    if len(index) < 2:
+        return []
+    minutes = bar_minutes(tf)
+    if minutes == MINUTES_PER_DAY:
+        index = index.normalize()
+    ts = index.as_unit('ns').asi8
+    all_ts = np.arange(ts[0], ts[-1] + 1, minutes * NS_PER_MINUTE, dtype=np.int64)
+    missing = np.setdiff1d(all_ts, ts)
+
+    breaks = []
+    if not (index.dayofweek >= 5).any():
+        breaks.append(dict(bounds=['sat', 'mon']))
+        missing = missing[pd.DatetimeIndex(missing).dayofweek < 5]
+    if minutes < MINUTES_PER_DAY:
+        minute_of_day = (ts // NS_PER_MINUTE) % MINUTES_PER_DAY
+        session_start = minute_of_day.min()
+        session_end = minute_of_day.max() + minutes
+        if session_start > 0 or session_end < MINUTES_PER_DAY:
+            breaks.append(dict(bounds=[float(session_end / 60), float(session_start / 60)], pattern='hour'))
+            missing_minute = (missing // NS_PER_MINUTE) % MINUTES_PER_DAY
+            missing = missing[(missing_minute >= session_start) & (missing_minute < session_end)]
+    if len(missing):
+        breaks.append(dict(dvalue=minutes * 60 * 1000, values=pd.DatetimeIndex(missing).strftime("%Y-%m-%d %H:%M:%S").tolist()))
+    return breaks
+
 
 class Plotter:
     """
@@ -51,13 +103,98 @@ class Plotter:
     }
     
     """
-    def __init__(self, plot_config: Optional[Dict[str, Any]] = None, init_ta=False):
+    def __init__(self, plot_config: Optional[Dict[str, Any]] = None, init_ta=False, reuse_figures=False, fast=False, renderer='plotly'):
+        """
+        reuse_figures: build the subplots and traces once per chart kind and indicator set, and only swap the trace data
+                       and layout of that figure for each chart. The returned figure is then reused by the next chart of the
+                       same kind, so write it (or submit it to a RenderPool) before creating the next chart.
+        fast: return plain figure dicts with the data as NumPy arrays, built from a validated template without validating
+              the data, shapes and annotations of each chart. For batch export (utils.write_file), not for interactive use.
+        renderer: backend used by write_image, see render.RENDERERS. Renderers other than 'plotly' draw figure dicts, so
+                  they imply 'fast'.
+        """
         self.init_ta = init_ta
         self.plot_config = {} 
         self.plot_config['ta_config'] = {**TA_PARAMS}    
         self.plot_config['trade_bars'] = {**TRADE_BARS_INCLUDED}
         if plot_config:
             self.plot_config.update(plot_config)            
+        if renderer not in render.RENDERERS:
+            raise ValueError(f"Unknown renderer '{renderer}', expected one of {render.RENDERERS}")
+        self.reuse_figures = reuse_figures
+        self.fast = fast or renderer != 'plotly'
+        self.renderer = renderer
+        self._figures: Dict[Tuple, Any] = {}
+
+    def write_image(self, fig: Union[go.Figure, Dict[str, Any]], filename: str, width: int, height: int) -> str:
+        """
+        Write a chart of this Plotter to '<filename>.png' with its renderer
+        """
+        return utils.write_file(fig, filename, width, height, renderer=self.renderer)
+
+    def _ta_color(self, ta: str) -> str:
+        return self.plot_config['ta_config'].get(ta, {}).get('color', 'black')
+
+    def _figure(self, indicators: List[str], volume_last: bool = False) -> Union[go.Figure, Dict[str, Any]]:
+        """
+        Figure with an empty candlestick, volume bar and indicator line traces (in that order, or the volume last).
+        With 'reuse_figures' the figure is built once per trace layout, and with 'fast' its dict is used as template.
+        """
+        key = (tuple((ta, self._ta_color(ta)) for ta in indicators), volume_last)
+        fig = self._figures.get(key) if self.reuse_figures or self.fast else None
+        if fig is None:
+            fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.01, row_heights=[0.8, 0.2])
+            fig.add_trace(go.Candlestick(), row=1, col=1)
+            if not volume_last:
+                fig.add_trace(go.Bar(name='Volume', marker=dict(color='blue')), row=2, col=1)
+            for ta in indicators:
+                fig.add_trace(go.Scatter(name=ta, line=dict(color=self._ta_color(ta))), row=1, col=1)
+            if volume_last:
+                fig.add_trace(go.Bar(name='Volume', marker=dict(color='blue')), row=2, col=1)
+            fig.update_layout(showlegend=False, xaxis_rangeslider_visible=False)
+            if self.fast:
+                fig = fig.to_dict()
+            if self.reuse_figures or self.fast:
+                self._figures[key] = fig
+        return fig
+
+    def _fill_figure(self, fig: Union[go.Figure, Dict[str, Any]], df: pd.DataFrame, symbol: str, indicators: List[str],
+                     volume_last: bool, title: str, shapes=(), annotations=(), breaks=()) -> Union[go.Figure, Dict[str, Any]]:
+        """
+        Set the trace data of a figure from _figure() and apply all layout changes in one batch
+        """
+        if isinstance(fig, dict):
+            return self._fill_dict(fig, df, symbol, indicators, volume_last, title, shapes, annotations, breaks)
+        x = df.index
+        with fig.batch_update():
+            fig.data[0].update(x=x, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'], name=symbol)
+            lines = fig.data[1:-1] if volume_last else fig.data[2:]
+            for line, ta in zip(lines, indicators):
+                line.update(x=x, y=df[ta])
+            fig.data[-1 if volume_last else 1].update(x=x, y=df['Volume'])
+            # Assigned instead of updated, which would merge them element-wise with those of a reused figure
+            fig.layout.shapes = shapes
+            fig.layout.annotations = annotations
+            fig.update_layout(title=title, xaxis_rangebreaks=breaks, xaxis2_rangebreaks=breaks)
+        return fig
+
+    @staticmethod
+    def _fill_dict(template: Dict[str, Any], df: pd.DataFrame, symbol: str, indicators: List[str], volume_last: bool, title: str,
+                   shapes, annotations, breaks) -> Dict[str, Any]:
+        # Shallow copies only, the (read only) template is shared by all charts
+        # Bars have whole seconds, which also keeps the encoded dates short
+        x = df.index.to_numpy().astype('datetime64[s]')
+        data = [dict(trace) for trace in template['data']]
+        data[0].update(x=x, open=df['Open'].to_numpy(), high=df['High'].to_numpy(), low=df['Low'].to_numpy(),
+                       close=df['Close'].to_numpy(), name=symbol)
+        lines = data[1:-1] if volume_last else data[2:]
+        for line, ta in zip(lines, indicators):
+            line.update(x=x, y=df[ta].to_numpy())
+        data[-1 if volume_last else 1].update(x=x, y=df['Volume'].to_numpy())
+        layout = dict(template['layout'], title={'text': title}, shapes=list(shapes), annotations=list(annotations))
+        layout['xaxis'] = dict(layout['xaxis'], rangebreaks=breaks)
+        layout['xaxis2'] = dict(layout['xaxis2'], rangebreaks=breaks)
+        return {'data': data, 'layout': layout}
         
                     
     # TODO: sip_start_marker and levels dicts documentation?
@@ -69,32 +206,13 @@ class Plotter:
                        ta_indicators: Optional[List[str]] = None): 
         add_rth_markers = df.index[0].time() < pd.Timestamp(f"{df.index[0].date()} 09:30").time()
     
-        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.01, row_heights=[0.8, 0.2])
-        candlestick = go.Candlestick(
-            x=df.index,
-            open=df['Open'],
-            high=df['High'],
-            low=df['Low'],
-            close=df['Close'],
-            name=symbol, # TODO: needed?
-        )
-        volume = go.Bar(x=df.index, y=df['Volume'], name='Volume', marker=dict(color='blue'))
-        fig.add_trace(candlestick, row=1, col=1)
-        fig.add_trace(volume, row=2, col=1)
-        
-        if ta_indicators:
-            for ta in ta_indicators: 
-                if ta in df.columns:
-                    color = self.plot_config['ta_config'].get(ta, {}).get('color', 'black')
-                    line = go.Scatter(
-                        x=df.index,
-                        y=df[ta],
-                        name=ta,
-                        line=dict(color=color),
-                    )
-                    fig.add_trace(line, row=1, col=1)
-                else:
-                    print(f"Indicator {ta} not found in df (columns={df.columns})")
+        indicators = []
+        for ta in ta_indicators or []:
+            if ta in df.columns:
+                indicators.append(ta)
+            else:
+                print(f"Indicator {ta} not found in df (columns={df.columns})")
+        fig = self._figure(indicators)
         
         shapes = []
         annotations = []
@@ -118,77 +236,59 @@ class Plotter:
                 b = f"{df.index[0].date()} 15:00"            
             y0 = df.loc[a:b]['Low'].min()
             y1 = df.loc[a:b]['High'].max()
-            shapes.append(dict(x0=pd.Timestamp(a), x1=pd.Timestamp(a), y0=y0, y1=y1, line_dash='dot', opacity=0.5))                    
-            shapes.append(dict(x0=pd.Timestamp(b), x1=pd.Timestamp(b), y0=y0, y1=y1.max(), line_dash='dot', opacity=0.5))
+            shapes.append(dict(x0=pd.Timestamp(a), x1=pd.Timestamp(a), y0=y0, y1=y1, line=dict(dash='dot'), opacity=0.5))                    
+            shapes.append(dict(x0=pd.Timestamp(b), x1=pd.Timestamp(b), y0=y0, y1=y1.max(), line=dict(dash='dot'), opacity=0.5))
         
         if levels is not None:    
             #TODO: assuming M15 for intraday (e.g. 26 bars)        
+            level_end = df.index[min(25, len(df) - 1)]
             if 'yday_mid' in levels:
                 # show mid during first day            
                 x_pos_yday_mid_0 = df.index[0]
-                x_pos_yday_mid_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_yday_mid_0, x1=x_pos_yday_mid_1, y0=levels['yday_mid'], y1=levels['yday_mid'], line_dash='longdash', line_color='blue', opacity=0.3))
+                x_pos_yday_mid_1 = level_end
+                shapes.append(dict(x0=x_pos_yday_mid_0, x1=x_pos_yday_mid_1, y0=levels['yday_mid'], y1=levels['yday_mid'], line=dict(dash='longdash', color='blue'), opacity=0.3))
                 annotations.append(dict(x=x_pos_yday_mid_0, y=levels['yday_mid'], xref='x', yref='y', showarrow=False, xanchor='left', text='Yday Mid'))        
             if 'close_1' in levels:
                 x_pos_close_0 = df.index[0]
-                x_pos_close_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_close_0, x1=x_pos_close_1, y0=levels['close_1'], y1=levels['close_1'], line_dash='dot', line_color='green', opacity=0.4))
+                x_pos_close_1 = level_end
+                shapes.append(dict(x0=x_pos_close_0, x1=x_pos_close_1, y0=levels['close_1'], y1=levels['close_1'], line=dict(dash='dot', color='green'), opacity=0.4))
                 annotations.append(dict(x=x_pos_close_0, y=levels['close_1'], xref='x', yref='y', showarrow=False, xanchor='left', text='close_1'))
             if 'low_1' in levels:
                 x_pos_low_0 = df.index[0]
-                x_pos_low_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_low_0, x1=x_pos_low_1, y0=levels['low_1'], y1=levels['low_1'], line_dash='longdash', line_color='green', opacity=0.3))
+                x_pos_low_1 = level_end
+                shapes.append(dict(x0=x_pos_low_0, x1=x_pos_low_1, y0=levels['low_1'], y1=levels['low_1'], line=dict(dash='longdash', color='green'), opacity=0.3))
                 annotations.append(dict(x=x_pos_low_0, y=levels['low_1'], xref='x', yref='y', showarrow=False, xanchor='left', text='low_1'))
             if 'high_1' in levels:
                 x_pos_high_0 = df.index[0]
-                x_pos_high_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_high_0, x1=x_pos_high_1, y0=levels['high_1'], y1=levels['high_1'], line_dash='longdash', line_color='green', opacity=0.3))
+                x_pos_high_1 = level_end
+                shapes.append(dict(x0=x_pos_high_0, x1=x_pos_high_1, y0=levels['high_1'], y1=levels['high_1'], line=dict(dash='longdash', color='green'), opacity=0.3))
                 annotations.append(dict(x=x_pos_high_0, y=levels['high_1'], xref='x', yref='y', showarrow=False, xanchor='left', text='high_1'))
             if 'eth_high' in levels:
                 x_pos_eth_high_0 = df.index[0]
-                x_pos_eth_high_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_eth_high_0, x1=x_pos_eth_high_1, y0=levels['eth_high'], y1=levels['eth_high'], line_dash='longdash', line_color='blue', opacity=0.2))
+                x_pos_eth_high_1 = level_end
+                shapes.append(dict(x0=x_pos_eth_high_0, x1=x_pos_eth_high_1, y0=levels['eth_high'], y1=levels['eth_high'], line=dict(dash='longdash', color='blue'), opacity=0.2))
                 annotations.append(dict(x=x_pos_eth_high_0, y=levels['eth_high'], xref='x', yref='y', showarrow=False, xanchor='left', text='eth_high'))
             if 'eth_low' in levels:
                 x_pos_eth_low_0 = df.index[0]
-                x_pos_eth_low_1 = df.index[25]
-                shapes.append(dict(x0=x_pos_eth_low_0, x1=x_pos_eth_low_1, y0=levels['eth_low'], y1=levels['eth_low'], line_dash='longdash', line_color='blue', opacity=0.2))
+                x_pos_eth_low_1 = level_end
+                shapes.append(dict(x0=x_pos_eth_low_0, x1=x_pos_eth_low_1, y0=levels['eth_low'], y1=levels['eth_low'], line=dict(dash='longdash', color='blue'), opacity=0.2))
                 annotations.append(dict(x=x_pos_eth_low_0, y=levels['eth_low'], xref='x', yref='y', showarrow=False, xanchor='left', text='eth_low'))
             if 'today_mid' in levels:    
                 #x_pos_today_mid_0 = df.index[26]
                 #x_pos_today_mid_1 = df.index[52]
                 x_pos_today_mid_0 = f"{df.index[0].date()} 09:30"
                 x_pos_today_mid_1 = f"{df.index[0].date()} 15:45"
-                shapes.append(dict(x0=x_pos_today_mid_0, x1=x_pos_today_mid_1, y0=levels['today_mid'], y1=levels['today_mid'], line_dash='longdash', line_color='blue', opacity=0.2))
+                shapes.append(dict(x0=x_pos_today_mid_0, x1=x_pos_today_mid_1, y0=levels['today_mid'], y1=levels['today_mid'], line=dict(dash='longdash', color='blue'), opacity=0.2))
                 annotations.append(dict(x=x_pos_today_mid_0, y=levels['today_mid'], xref='x', yref='y', showarrow=False, xanchor='left', text='Today Mid'))
-        # TODO: add back again in better way if needed
-        # if or_times:
-        #     lowest, highest = utils_ta.or_levels(df, or_times)
-        #     # TODO: a more simple way to select 10:30? e.g. bar 12?
-        #     shapes.append(dict(x0=df.index[0], x1=pd.Timestamp(f"{df.index[0].date()} {or_times[1]}"), y0=lowest, y1=lowest, line_dash='dash', opacity=0.5))
-        #     shapes.append(dict(x0=df.index[0], x1=pd.Timestamp(f"{df.index[0].date()} {or_times[1]}"), y0=highest, y1=highest, line_dash='dash', opacity=0.5))
-        #     # fig.update_layout(shapes=[
-        #     #     dict(x0=df.index[0], x1=pd.Timestamp(f"{df.index[0].date()} {or_times[1]}"), y0=lowest, y1=lowest, line_dash='dash', opacity=0.5),
-        #     #     dict(x0=df.index[0], x1=pd.Timestamp(f"{df.index[0].date()} {or_times[1]}"), y0=highest, y1=highest, line_dash='dash', opacity=0.5)
-        #     # ])
+            # Opening ranges, e.g. 'or_high' or 'or30_low' (see utils.levels_table), drawn for the first day
+            for key in sorted(key for key in levels if OR_LEVEL.match(key)):
+                x_pos_or_0 = f"{df.index[0].date()} 09:30"
+                x_pos_or_1 = f"{df.index[0].date()} 15:45"
+                shapes.append(dict(x0=x_pos_or_0, x1=x_pos_or_1, y0=levels[key], y1=levels[key], line=dict(dash='dash', color='grey'), opacity=0.5))
+                annotations.append(dict(x=x_pos_or_1, y=levels[key], xref='x', yref='y', showarrow=False, xanchor='right', text=key))
 
-        if shapes:
-            fig.update_layout(shapes=shapes)
-        if annotations:
-            fig.update_layout(annotations=annotations)
-        fig.update_layout(showlegend=False)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-        fig.update_layout(title=title)
-        
-        dt_all = pd.date_range(start=df.index[0], end=df.index[-1], freq=tf)
-        dt_breaks = [d for d in dt_all.strftime("%Y-%m-%d %H:%M:%S").tolist() if not d in df.index]
-        if 'min' in tf:
-            minutes = int(tf[:-3]) # TODO: handle other than 'min'?
-        else:
-            minutes = 24 * 60 
-        fig.update_xaxes(rangebreaks=[dict(dvalue=minutes * 60 * 1000, values=dt_breaks)])
-        
-        return fig
+        breaks = rangebreaks(df.index, tf)
+        return self._fill_figure(fig, df, symbol, indicators, False, title, shapes, annotations, breaks)
 
     
     def trade_chart(self, trade, df, tf, title, plot_indicators):
@@ -202,11 +302,11 @@ class Plotter:
             - symbol (str): The symbol of the traded asset.
             - value (float): The value of the trade.
             - long_short (str): Indicates whether the trade was a 'LONG' or 'SHORT' trade.
-            - quantity (int): The quantity of the asset that was traded.
+            - quantity (int): The quantity of the asset that was traded, omitted if None.
             - entry_price (float): The price at which the asset was bought or sold at the start of the trade.
             - exit_price (float): The price at which the asset was sold or bought back at the end of the trade.
             - pnl (float): The profit or loss from the trade.
-            - comment (str): Any comments on the trade.
+            - comment (str): Any comments on the trade, may be empty.
         df (DataFrame): The data frame containing the price data.
         tf (str): The timeframe of the data.
         title (str): The title of the plot.
@@ -230,77 +330,36 @@ class Plotter:
             logger.debug(f"df empty for {trade.symbol} {trade.entry_date} - {trade.exit_date}")
             # TODO: return None here?
         
-        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.01, row_heights=[0.8, 0.2])
-        candlestick = go.Candlestick(x=plot_df.index, open=plot_df['Open'], high=plot_df['High'], low=plot_df['Low'], close=plot_df['Close'], name=trade.symbol)
-        volume = go.Bar(x=plot_df.index, y=plot_df['Volume'], name='Volume', marker=dict(color='blue'))
-
-        ta_lines = []
-        for ta in plot_indicators:
-            line = go.Scatter(
-                x=plot_df.index,
-                y=plot_df[ta],
-                name=ta,
-                line=dict(color=self.plot_config['ta_config'].get(ta, {}).get('color', 'black')),
-            )
-            ta_lines.append(line)
-
-        fig.add_trace(candlestick, row=1, col=1)
-        for line in ta_lines:
-            fig.add_trace(line, row=1, col=1)
-        fig.add_trace(volume, row=2, col=1)
+        fig = self._figure(plot_indicators, volume_last=True)
 
         if trade.value < 0:
             v_align = -100
         else:
             v_align = 100
 
-        entry_text = f"SHORT {trade.quantity}@{trade.entry_price} (val: {trade.value:.0f})" if trade.long_short == 'SHORT' else f"LONG {trade.quantity}@{trade.entry_price} ({trade.value:.0f})"
-        exit_text = f"Exit {trade.quantity}@{trade.exit_price} (pnl: {trade.pnl:.1f}) - {trade.comment}"
+        quantity = f"{trade.quantity}" if trade.quantity is not None else ''
+        entry_text = f"SHORT {quantity}@{trade.entry_price} (val: {trade.value:.0f})" if trade.long_short == 'SHORT' else f"LONG {quantity}@{trade.entry_price} ({trade.value:.0f})"
+        exit_text = f"Exit {quantity}@{trade.exit_price} (pnl: {trade.pnl:.1f})" + (f" - {trade.comment}" if trade.comment else '')
         #TODO: mark SL and target level?
-        fig.add_annotation(
-            x=trade.entry_date, y=trade.entry_price, text=entry_text, showarrow=True, arrowhead=1, ay=v_align, arrowwidth=1.5, arrowsize=1.5, font=dict(size=14)
-        )
-        fig.add_annotation(
-            x=trade.exit_date, y=trade.exit_price, text=exit_text, showarrow=True, arrowhead=1, ay=v_align, arrowwidth=1.5, arrowsize=1.5, font=dict(size=14)
-        )
+        annotations = [
+            dict(x=trade.entry_date, y=trade.entry_price, text=entry_text, showarrow=True, arrowhead=1, ay=v_align, arrowwidth=1.5, arrowsize=1.5, font=dict(size=14)),
+            dict(x=trade.exit_date, y=trade.exit_price, text=exit_text, showarrow=True, arrowhead=1, ay=v_align, arrowwidth=1.5, arrowsize=1.5, font=dict(size=14)),
+        ]
 
-        fig.update_layout(showlegend=False)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-        fig.update_layout(title=title)
         # fig.update_layout(xaxis_type='date', xaxis=dict(dtick=180*60*1000))
         #TODO: fix range breaks for higher timeframes
-        if tf not in ['week', 'month', 'day']:
-            dt_all = pd.date_range(start=plot_df.index[0], end=plot_df.index[-1], freq='1D' if tf == 'day' else tf)
-            dt_breaks = [d for d in dt_all.strftime("%Y-%m-%d %H:%M:%S").tolist() if not d in plot_df.index]
-            # dt_breaks = pd.to_datetime(['2023-09-29 17:00:00', '2023-09-29 20:00:00', '2023-09-29 23:00:00', '2023-09-30 02:00:00', '2023-09-30 05:00:00',
-            #                            '2023-09-30 08:00:00', '2023-09-30 11:00:00', '2023-09-30 14:00:00', '2023-09-30 17:00:00', '2023-09-30 20:00:00',
-            #                            '2023-09-30 23:00:00', '2023-10-01 02:00:00', '2023-10-01 05:00:00', '2023-10-01 08:00:00', '2023-10-01 11:00:00', '2023-10-01 14:00:00'])
-            minutes = int(tf[:-3]) # TODO: handle other than 'min'?
-            fig.update_xaxes(rangebreaks=[dict(dvalue=minutes * 60 * 1000, values=dt_breaks)]) # dvalue in ms?
-
-        return fig
+        breaks = rangebreaks(plot_df.index, tf) if tf not in ['week', 'month', 'day'] else []
+        return self._fill_figure(fig, plot_df, trade.symbol, plot_indicators, True, title, annotations=annotations, breaks=breaks)
 
 
     def daily_chart(self, df: pd.DataFrame, symbol: str, title:str,
                     from_date='', to_date='', 
                     sip_date: Optional[pd.Timestamp] = None,
                     sip_text=''):
-        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.01, row_heights=[0.8, 0.2])        
+        fig = self._figure([])
         if from_date and to_date:
             df = df[from_date:to_date]
         
-        candlestick = go.Candlestick(
-            x=df.index,
-            open=df['Open'],
-            high=df['High'],
-            low=df['Low'],
-            close=df['Close'],
-            name=symbol,
-        )
-        volume = go.Bar(x=df.index, y=df['Volume'], name='Volume', marker=dict(color='blue'))
-        fig.add_trace(candlestick, row=1, col=1)    
-        fig.add_trace(volume, row=2, col=1)
-        
         annotations = []        
         if sip_date is not None:
             # remove hours/min from pd.datetime
@@ -314,18 +373,9 @@ class Plotter:
             annotations.append(dict(x=sip_date_str, y=y_pos, text=formatted_text, ay=100, showarrow=True, arrowhead=1, arrowwidth=1.5, arrowsize=1.5, font=dict(size=font_size)))
             
         
-        if annotations:
-            fig.update_layout(annotations=annotations)
-        fig.update_layout(showlegend=False)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-        fig.update_layout(title=title)
-        
-        # Remove weekends from fig using rangebreaks
-        dt_all = pd.date_range(start=df.index[0], end=df.index[-1], freq='1D')
-        dt_breaks = [d for d in dt_all.strftime("%Y-%m-%d %H:%M:%S").tolist() if not d in df.index]    
-        fig.update_xaxes(rangebreaks=[dict(dvalue=1 * 24 * 60 * 60 * 1000, values=dt_breaks)])
-        
-        return fig
+        # Remove weekends and holidays from fig using rangebreaks
+        breaks = rangebreaks(df.index, 'day')
+        return self._fill_figure(fig, df, symbol, [], False, title, annotations=annotations, breaks=breaks)
 
 
 
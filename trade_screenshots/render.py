@@ -0,0 +1,195 @@
+from functools import lru_cache
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import threading
+import traceback
+from typing import Any, Dict, List, Optional, Union
+
+import plotly.io as pio
+from plotly.utils import PlotlyJSONEncoder
+
+from trade_screenshots import instrument
+from trade_screenshots.manifest import Manifest
+
+
+logger = logging.getLogger(__name__)
+
+# Queue of the RenderPool figures are handed to in this process, see install()
+_queue: Optional[Any] = None
+
+# 'plotly' exports with Kaleido, 'matplotlib' draws Plotter(fast=True) figure dicts on the Agg canvas (optional dependency)
+RENDERERS = ['plotly', 'matplotlib']
+# 'process' exports in separate processes (figures are sent as JSON), 'thread' in threads of the submitting process
+RENDER_MODES = ['process', 'thread']
+# Default bound of the queue per export worker. A full queue blocks submit() so the figures (and their data) waiting
+# for export don't pile up in memory when the charts are built faster than they are written.
+QUEUED_PER_WORKER = 4
+
+
+@lru_cache(maxsize=None)
+def makedirs(directory: str) -> None:
+    """
+    Create 'directory' once per process instead of checking it for every image
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def write_image(fig: Any, path: str, width: int, height: int, renderer: str = 'plotly') -> None:
+    with instrument.timer('render'):
+        _write_image(fig, path, width, height, renderer)
+
+
+def _write_image(fig: Any, path: str, width: int, height: int, renderer: str) -> None:
+    if renderer == 'plotly':
+        # Figure dicts (Plotter(fast=True)) are exported without validation
+        pio.write_image(fig, path, width=width, height=height, validate=not isinstance(fig, dict))
+    elif renderer == 'matplotlib':
+        try:
+            from trade_screenshots import mpl_renderer
+        except ImportError as e:
+            raise ImportError(f"The 'matplotlib' renderer requires matplotlib: {e}") from e
+        mpl_renderer.write_image(fig if isinstance(fig, dict) else fig.to_dict(), path, width, height)
+    else:
+        raise ValueError(f"Unknown renderer '{renderer}', expected one of {RENDERERS}")
+
+
+def _render_loop(queue, results=None, failed=None) -> None:
+    # Each renderer process keeps its Kaleido instance alive for all figures it exports
+    if results is not None:
+        # Drop the timers inherited from the parent process (fork)
+        instrument.snapshot()
+    # Paths of the images that could not be written, see RenderPool.failed
+    failed = [] if failed is None else failed
+    while True:
+        item = queue.get()
+        if item is None:
+            # The render timers, counters and peak RSS of this process and its failed exports, see RenderPool.close()
+            if results is not None:
+                results.put((instrument.snapshot(), failed))
+            break
+        fig, path, width, height, renderer = item
+        try:
+            makedirs(os.path.dirname(path))
+            # Figures of RenderPool(mode='process') arrive as JSON
+            write_image(json.loads(fig) if isinstance(fig, str) else fig, path, width, height, renderer)
+            logger.debug(f"Wrote '{path}'")
+        except Exception as e:
+            print(f"Error writing '{path}': {e}")
+            traceback.print_exc()
+            failed.append(path)
+            instrument.export_failed(path)
+
+
+class RenderPool:
+    """
+    A fixed set of long-lived export workers writing the figures received over a bounded queue, so that building the
+    next chart overlaps with exporting the previous ones.
+
+    mode='process': renderer processes shared by the data workers, so that the (slow to start and memory hungry)
+                    Kaleido export runs in N processes instead of once per data worker.
+    mode='thread': renderer threads of this process. Figures are handed over as is instead of as JSON. Kaleido exports
+                   one image at a time per process, so more than one thread mainly helps the matplotlib renderer.
+    max_queued: figures waiting for export before submit() blocks, 0 for QUEUED_PER_WORKER per worker
+    report: instrument.RunReport the snapshots of the renderer processes are added to when the pool is closed
+    manifest: Manifest whose entries of the images that failed to export are discarded when the pool is closed.
+              Entries are recorded when a figure is submitted, so merge those of the data workers before closing.
+
+    with RenderPool(2) as pool:
+        # figures passed to utils.write_file in this process are now exported by the pool
+        with ProcessPoolExecutor(initializer=render.install, initargs=(pool.queue,)) as executor:
+            # ... and so are figures from the executor's workers (mode='process' only)
+    """
+    def __init__(self, workers: int = 2, mode: str = 'process', max_queued: int = 0, report: Optional[instrument.RunReport] = None,
+                 manifest: Optional[Manifest] = None):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode '{mode}', expected one of {RENDER_MODES}")
+        self.workers = workers
+        self.mode = mode
+        max_queued = max_queued or QUEUED_PER_WORKER * workers
+        self.queue = multiprocessing.Queue(max_queued) if mode == 'process' else queue_module.Queue(max_queued)
+        # The renderer threads time into this process, the renderer processes send their instrument.snapshot() back
+        self.results = multiprocessing.Queue() if mode == 'process' else None
+        self.snapshots: List[Dict[str, Any]] = []
+        self.report = report
+        self.manifest = manifest
+        # Paths of the images the workers failed to write, complete after close()
+        self.failed: List[str] = []
+        self._workers: List[Union[multiprocessing.Process, threading.Thread]] = []
+        self._previous_queue = None
+
+    def start(self) -> 'RenderPool':
+        for _ in range(self.workers):
+            if self.mode == 'process':
+                worker = multiprocessing.Process(target=_render_loop, args=(self.queue, self.results), daemon=True)
+            else:
+                worker = threading.Thread(target=_render_loop, args=(self.queue, None, self.failed), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def close(self) -> None:
+        """
+        Wait for all submitted figures to be written and stop the renderer processes, collecting their snapshots and
+        failed exports.
+        """
+        for _ in self._workers:
+            self.queue.put(None)
+        if self.results is not None:
+            # Read before join(), a process doesn't exit before its queued snapshot is consumed
+            for data, failed in (self.results.get() for _ in self._workers):
+                self.snapshots.append(data)
+                self.failed.extend(failed)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self) -> 'RenderPool':
+        self._previous_queue = _queue
+        install(self.queue)
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        install(self._previous_queue)
+        self.close()
+        if self.manifest is not None:
+            self.manifest.discard(self.failed)
+        if self.report is not None:
+            for data in self.snapshots:
+                self.report.add(data)
+
+
+def install(queue) -> None:
+    """
+    Hand figures written in this process to the RenderPool owning 'queue' (None to export in-process again).
+    Used as ProcessPoolExecutor/Pool initializer for data preparation workers.
+    """
+    global _queue
+    _queue = queue
+
+
+def export_stage() -> str:
+    """
+    Name of the instrument.timer() stage around Plotter.write_image: 'submit' when a RenderPool is installed in this
+    process (only the hand-over to the pool is timed, the export itself is timed as 'render' by the pool), else 'export'
+    """
+    return 'export' if _queue is None else 'submit'
+
+
+def submit(fig: Any, path: str, width: int, height: int, renderer: str = 'plotly') -> bool:
+    """
+    Queue 'fig' for export to 'path' if a RenderPool is installed in this process. Returns False if not. Blocks while
+    the queue of the pool is full.
+    """
+    if _queue is None:
+        return False
+    if isinstance(_queue, queue_module.Queue):
+        # Plotter(reuse_figures=True) figures are updated by the next chart, so threads get a copy of those
+        fig = fig if isinstance(fig, dict) else fig.to_dict()
+    else:
+        fig = fig.to_json() if hasattr(fig, 'to_json') else json.dumps(fig, cls=PlotlyJSONEncoder)
+    _queue.put((fig, path, width, height, renderer))
+    return True
@@ -1,14 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
+from functools import partial
 import json
 import logging
 from multiprocessing import Pool
 import os
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from trade_screenshots.plotter import Plotter
 import trade_screenshots.utils as utils
-from trade_screenshots import utils_ta
+from trade_screenshots import instrument, render, utils_ta
+from trade_screenshots.manifest import Manifest, chart_digest
+from trade_screenshots.render import RenderPool
 from trade_screenshots.common import VALID_TIME_FRAMES, weekday_to_string
 
 
@@ -19,6 +24,13 @@ logger = logging.getLogger(__name__)
 
 VALID_TA =  ['EMA10', 'EMA20', 'EMA50', 'VWAP']
 
+DAILY_DAYS_BEFORE = 100
+DAILY_DAYS_AFTER = 20
+# Intraday history may start this many days after the daily chart start and still be used for the daily bars
+DAILY_DERIVE_TOLERANCE_DAYS = 7
+# Levels (see utils.LEVEL_COLUMNS) drawn on the intraday charts by default
+SIP_LEVELS = ['yday_mid', 'today_mid']
+
 @dataclass
 class SipConfig:
     start: str
@@ -34,6 +46,15 @@ class SipConfig:
     days_after: int = 0    
     gen_daily: bool = False    
     ta_indicators: List[str] = None
+    workers: int = 0  # Number of processes used to handle symbols in parallel, 0 to run sequentially
+    renderers: int = 0  # Number of image export workers, 0 to export synchronously while creating the charts
+    render_mode: str = 'process'  # 'process': export processes shared by all workers, 'thread': export threads in each worker
+    renderer: str = 'plotly'  # Image backend, see render.RENDERERS
+    force: bool = False  # Recreate charts even if their inputs are unchanged since the last run, see manifest.Manifest
+    levels: List[str] = None  # Levels of the first chart day drawn on the intraday charts, None for SIP_LEVELS
+    report: str = ''  # Write the stage timings, cache hit rates and peak RSS of the run to this JSON file, see instrument.RunReport
+    profile: str = ''  # Profile each symbol into this directory (in the process handling it)
+    profiler: str = 'cprofile'  # See instrument.PROFILERS
     #rth_ta: bool = True
 
 def add_ta(sym, df, indicators, rth_only_ta=False):
@@ -43,31 +64,110 @@ def add_ta(sym, df, indicators, rth_only_ta=False):
     if rth_only_ta:
         df = utils_ta.add_ta(sym, df, indicators, start_time='09:30', end_time='16:00')
     else:
-        df = utils_ta.add_ta(sym, df, indicators)
-        if 'VWAP' in indicators:
-            df = utils_ta.add_ta(sym, df, ['VWAP'], separate_by_day=True)
+        # VWAP restarts each day, the other indicators run over the whole chart
+        df = utils_ta.add_ta(sym, df, indicators, session_reset=['VWAP'])
     return df
         
         
 
 
-def get_dfs(config, first_date, last_date, timeframe, provider, paths, sym):
+def get_dfs(config, dates_sorted, timeframe, provider, paths, sym):
     daily_df = None
+    first_date, _ = utils.get_plot_dates_weekend_adjusted(dates_sorted[0], config.days_before, config.days_after)
+    _, last_date = utils.get_plot_dates_weekend_adjusted(dates_sorted[-1], config.days_before, config.days_after)
+    daily_start = dates_sorted[0] - pd.Timedelta(days=DAILY_DAYS_BEFORE)
+    daily_end = dates_sorted[-1] + pd.Timedelta(days=DAILY_DAYS_AFTER)
+    # Derive the daily bars from the intraday ones instead of reading the 'day' file too, if the timeframe allows it
+    derive_daily = config.gen_daily and utils.can_derive_daily(timeframe)
+    load_start, load_end = (min(first_date, daily_start), max(last_date, daily_end)) if derive_daily else (first_date, last_date)
     # TODO: config.rth_only
-    df = utils.get_dataframe(provider, sym, first_date, '', timeframe, path=paths[provider])
-    if config.gen_daily:
-        daily_df = utils.get_dataframe(provider, sym, first_date, '', 'day', path=paths[provider])
+    # Only read the bars needed for the charts instead of the full history, as views of the memory mapped bar cache
+    df = utils.get_dataframe(provider, sym, f"{load_start.date()}", f"{load_end.date()}", timeframe, path=paths[provider], copy=False)
 
+    if df.empty:
+        raise ValueError(f"{sym}: Missing data for {first_date} - {last_date} ({timeframe})")
     print(f"{sym}: df start='{df.index[0]}' end='{df.index[-1]}'")
-    if config.gen_daily:
+    if config.gen_daily and not (derive_daily and df.index[0] <= daily_start + pd.Timedelta(days=DAILY_DERIVE_TOLERANCE_DAYS)):
+        # Intraday history shorter than the daily chart
+        daily_df = utils.get_dataframe(provider, sym, f"{daily_start.date()}", f"{daily_end.date()}", 'day', path=paths[provider])
         print(f"{sym}: daily_df start='{daily_df.index[0]}' end='{daily_df.index[-1]}'")
-                
-    if first_date < df.index[0] or last_date > df.index[-1]:
-        raise ValueError(f"{sym}: Missing data for {first_date} - {last_date} ({timeframe}) (df={df.index[0]} - {df.index[-1]})")
+
+    # The frame is bounded by [first_date, last_date], so require the SIP dates themselves to be covered
+    if dates_sorted[0] < df.index[0].normalize() or dates_sorted[-1] > df.index[-1].normalize():
+        raise ValueError(f"{sym}: Missing data for {dates_sorted[0]} - {dates_sorted[-1]} ({timeframe}) (df={df.index[0]} - {df.index[-1]})")
     
     return df, daily_df
         
 
+def process_symbol(config: SipConfig, timeframes_to_plot: List[str], manifest: Manifest, sym: str, dates: List[pd.Timestamp]) -> Optional[Dict[str, str]]:
+    """
+    Load the data for 'sym' once and create all charts for its SIP dates. Returns the manifest entries of the charts
+    written, or None on error. Errors are reported and swallowed so one bad symbol doesn't stop the rest of the batch.
+    """
+    timeframe = config.timeframe
+    outdir = config.outdir
+    days_before = config.days_before
+    days_after = config.days_after
+    ta_indicators = config.ta_indicators
+    try:
+        dates_sorted = sorted(dates)
+        with instrument.timer('load', sym):
+            df, daily_df = get_dfs(config, dates_sorted, timeframe, config.provider, config.paths, sym)
+        # Charts are only exported, so skip the validation of each figure
+        plotter = Plotter(fast=True, renderer=config.renderer)
+        # All timeframes are aggregated once from the loaded bars and shared by the charts of every SIP date
+        derive_daily = daily_df is None and (config.gen_daily or timeframe == 'day')
+        with instrument.timer('aggregate', sym):
+            levels = utils.derive_timeframes(df, timeframe, timeframes_to_plot + (['day'] if derive_daily else []))
+        if daily_df is None:
+            daily_df = levels.get('day')
+            if daily_df is not None and timeframe != 'day':
+                print(f"{sym}: daily_df (derived) start='{daily_df.index[0]}' end='{daily_df.index[-1]}'")
+
+        level_keys = SIP_LEVELS if config.levels is None else config.levels
+        # Looked up per chart from the levels table of the symbol's full history (cached with the bars)
+        with instrument.timer('levels', sym):
+            level_table = utils.get_levels(config.provider, sym, timeframe, config.paths[config.provider]) if level_keys and timeframe != 'day' else None
+
+        written = []
+        # Sequential runs share the thread pipeline of handle_sip, pool workers export the charts of each symbol in
+        # threads of their own
+        own_pipeline = config.renderers > 0 and config.render_mode == 'thread' and config.workers > 0
+        with RenderPool(config.renderers, 'thread') if own_pipeline else nullcontext() as render_pool:
+            for date in dates_sorted:
+                start_date, end_date = utils.get_plot_dates_weekend_adjusted(date, days_before, days_after)
+                print(f"{sym}: creating intraday chart '{start_date}' to '{end_date}', for SIP date='{date}' ({weekday_to_string(date.weekday())})")
+
+                if timeframe == 'day':
+                    written.append(create_daily_chart(plotter, manifest, outdir, sym, daily_df, date))
+                else:
+                    for tf in timeframes_to_plot:
+                        with instrument.timer('slice', sym):
+                            chart_df = levels[tf].loc[f"{start_date}":f"{end_date}"]
+                            chart_levels = utils.day_levels(level_table, chart_df.index[0], level_keys) if level_table is not None and not chart_df.empty else None
+                        written.append(create_intraday_chart(plotter, manifest, outdir, ta_indicators, sym, date, chart_df, tf, chart_levels))
+                    if config.gen_daily:
+                        written.append(create_daily_chart(plotter, manifest, outdir, sym, daily_df, date))
+        entries = dict(entry for entry in written if entry)
+        if render_pool is not None:
+            # Only the charts actually written are current
+            manifest.discard(render_pool.failed, entries)
+        return entries
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"{sym}: {e}. Skipping.") 
+        return None
+
+
+def run_symbols(func, symbol_dates: Dict[str, List[pd.Timestamp]], workers: int, render_queue=None) -> List[Any]:
+    if workers > 0 and len(symbol_dates) > 1:
+        # One task per symbol so each worker loads the symbol's data once for all of its dates
+        with ProcessPoolExecutor(max_workers=workers, initializer=render.install, initargs=(render_queue,)) as executor:
+            return list(executor.map(func, symbol_dates.keys(), symbol_dates.values()))
+    return [func(sym, dates) for sym, dates in symbol_dates.items()]
+
+
 # TODO StocksInPlay class
 def handle_sip(config: SipConfig):
     if config.symbol:
@@ -75,13 +175,7 @@ def handle_sip(config: SipConfig):
     else:
         symbol_dates = utils.parse_txt(config.symbols_file)
     timeframe = config.timeframe
-    provider = config.provider
-    outdir = config.outdir
     transform = config.transform
-    days_before = config.days_before
-    days_after = config.days_after
-    paths = config.paths
-    ta_indicators = config.ta_indicators
     
     if transform != '':
         timeframes_to_plot = transform.split(',')
@@ -89,62 +183,77 @@ def handle_sip(config: SipConfig):
             raise ValueError(f"Invalid timeframe in transform '{transform}'")
     else:
         timeframes_to_plot = [timeframe]
+    if config.renderer not in render.RENDERERS:
+        raise ValueError(f"Invalid renderer '{config.renderer}', expected one of {render.RENDERERS}")
+    if config.render_mode not in render.RENDER_MODES:
+        raise ValueError(f"Invalid render mode '{config.render_mode}', expected one of {render.RENDER_MODES}")
     
-    for sym in symbol_dates.keys():
-        try:
-            dates_sorted = sorted(symbol_dates[sym])     
-            first_date = dates_sorted[0] - pd.Timedelta(days=days_before)
-            last_date = dates_sorted[-1] + pd.Timedelta(days=days_after)
-            
-            df, daily_df = get_dfs(config, first_date, last_date, timeframe, provider, paths, sym)
+    if config.profiler not in instrument.PROFILERS:
+        raise ValueError(f"Invalid profiler '{config.profiler}', expected one of {instrument.PROFILERS}")
+    
+    report = instrument.RunReport(config.report, symbols=len(symbol_dates), timeframe=timeframe, transform=transform, workers=config.workers,
+                                  renderers=config.renderers, render_mode=config.render_mode, renderer=config.renderer)
+    manifest = Manifest(config.outdir, config.force)
+    # Each task returns its timers and counters with its result, so those of the pool workers end up in the report
+    func = partial(instrument.collected, partial(process_symbol, config, timeframes_to_plot, manifest), config.profile, config.profiler)
+    shared_pool = config.renderers > 0 and (config.render_mode == 'process' or config.workers == 0)
+    with RenderPool(config.renderers, config.render_mode, report=report, manifest=manifest) if shared_pool else nullcontext() as render_pool:
+        outcomes = run_symbols(func, symbol_dates, config.workers, render_pool.queue if render_pool is not None else None)
+        results = []
+        # The workers only read the manifest, the entries of their charts are merged here (before the RenderPool is
+        # closed, which discards those of failed exports)
+        for entries, data in outcomes:
+            report.add(data)
+            results.append(entries)
+            if entries:
+                manifest.update(entries)
+    print(f"Created {len(manifest.updates)} charts")
+    manifest.save()
+    failed = sum(entries is None for entries in results)
+    if failed:
+        print(f"Failed to process {failed} of {len(results)} symbols")
+    print(instrument.summary(report.save()))
 
-            for date in dates_sorted:
-                # TODO: parallelize this loop              
-                start_date, end_date = utils.get_plot_dates_weekend_adjusted(date, days_before, days_after)
-                print(f"{sym}: creating intraday chart '{start_date}' to '{end_date}', for SIP date='{date}' ({weekday_to_string(date.weekday())})")
 
-                df = df.sort_index() # !?
-                chart_df = df.loc[f"{start_date}":f"{end_date}"]
-                
-                chart_df = add_ta(sym, chart_df, ta_indicators)
-                
-                # Daily/intraday levels:                
-                # rth_0 = df.loc[f"{start_date} 09:30":f"{start_date} 15:45"]
-                # mid = (rth_0['High'].max() + rth_0['Low'].min()) / 2
-                # levels = {'today_mid': mid}            
+def create_intraday_chart(plotter, manifest, outdir, ta_indicators, sym, date, chart_df, tf, levels=None) -> Optional[Tuple[str, str]]:
+    """
+    Returns the manifest entry of the chart, or None if it is unchanged since the last run
+    """
+    filename = f"{outdir}/{sym}-{date.strftime('%Y-%m-%d')}-{tf}"
+    title = f"{sym} {date} ({tf})"
+    sip_start_marker = {'text': f"SIP Start {date.strftime('%Y-%m-%d')}"}
+    # The digest is taken before TA, which only depends on the bars and the indicators
+    digest = chart_digest(chart_df, chart='intraday', tf=tf, title=title, sip_start_marker=sip_start_marker, ta_indicators=ta_indicators,
+                          levels=levels, plot_config=plotter.plot_config, renderer=plotter.renderer)
+    if manifest.is_current(filename, digest):
+        print(f"{sym}: '{filename}.png' is up to date")
+        return None
+    key = manifest.key(filename)
+    with instrument.timer('ta', sym, key):
+        chart_df = add_ta(sym, chart_df, ta_indicators)
+    with instrument.timer('figure', sym, key):
+        fig = plotter.intraday_chart(chart_df, tf, sym, title=title,
+                                                    sip_start_marker=sip_start_marker,
+                                                    levels=levels,
+                                                    ta_indicators=ta_indicators
+                                                    )
+    with instrument.timer(render.export_stage(), sym, key):
+        plotter.write_image(fig, filename, 1600, 900)
+    return key, digest
 
-                if timeframe == 'day':
-                    create_daily_chart(outdir, sym, daily_df, date)
-                else:
-                    for tf in timeframes_to_plot:
-                        create_intraday_chart(timeframe, outdir, ta_indicators, sym, date, chart_df, tf)                
-                    if config.gen_daily:
-                        create_daily_chart(outdir, sym, daily_df, date)
-                    
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            print(f"{sym}: {e}. Skipping.") 
-
-
-def create_intraday_chart(timeframe, outdir, ta_indicators, sym, date, chart_df, tf):
-    chart_df = utils.transform_timeframe(chart_df, timeframe, tf)
-    plotter = Plotter()                    
-    fig = plotter.intraday_chart(chart_df, tf, sym, title=f"{sym} {date} ({tf})",                                                
-                                                sip_start_marker={'text': f"SIP Start {date.strftime('%Y-%m-%d')}"},
-                                                #levels=levels
-                                                ta_indicators=ta_indicators
-                                                )
-    utils.write_file(fig, f"{outdir}/{sym}-{date.strftime('%Y-%m-%d')}-{tf}", 1600, 900)
-
-def create_daily_chart(outdir, sym, daily_df, date):
-    plotter = Plotter()
-    daily_days_before = 100
-    daily_days_after = 20
-    start_date = date - pd.Timedelta(days=daily_days_before)
-    end_date = date + pd.Timedelta(days=daily_days_after)
+def create_daily_chart(plotter, manifest, outdir, sym, daily_df, date) -> Optional[Tuple[str, str]]:
+    start_date = date - pd.Timedelta(days=DAILY_DAYS_BEFORE)
+    end_date = date + pd.Timedelta(days=DAILY_DAYS_AFTER)
     daily_chart_df = daily_df.loc[f"{start_date}":f"{end_date}"]    
-    fig = plotter.daily_chart(daily_chart_df, sym, title=f"{sym} {date.strftime('%Y-%m-%d')} (daily)", sip_date=date, sip_text='')
-    utils.write_file(fig, f"{outdir}/{sym}-{date.strftime('%Y-%m-%d')}-daily", 1600, 900)
-
-
+    filename = f"{outdir}/{sym}-{date.strftime('%Y-%m-%d')}-daily"
+    title = f"{sym} {date.strftime('%Y-%m-%d')} (daily)"
+    digest = chart_digest(daily_chart_df, chart='daily', title=title, sip_date=date, plot_config=plotter.plot_config, renderer=plotter.renderer)
+    if manifest.is_current(filename, digest):
+        print(f"{sym}: '{filename}.png' is up to date")
+        return None
+    key = manifest.key(filename)
+    with instrument.timer('figure', sym, key):
+        fig = plotter.daily_chart(daily_chart_df, sym, title=title, sip_date=date, sip_text='')
+    with instrument.timer(render.export_stage(), sym, key):
+        plotter.write_image(fig, filename, 1600, 900)
+    return key, digest
@@ -1,115 +1,154 @@
 from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, nullcontext
 from functools import partial
 
+from trade_screenshots.manifest import Manifest, chart_digest
 from trade_screenshots.plotter import Plotter
 import trade_screenshots.utils as utils
-from trade_screenshots import utils_ta
+from trade_screenshots import instrument, render, utils_ta
+from trade_screenshots.render import RenderPool
 from trade_screenshots.common import try_process_symbol
 
+# Levels drawn on the day by day charts, see utils.levels_table
+DAY_LEVELS = ['close_1', 'high_1', 'low_1', 'eth_low', 'eth_high', 'or_high', 'or_low']
+# Indicator columns drawn on the day by day charts
+DAY_TA = ['VWAP', 'EMA10', 'EMA20', 'EMA50', 'BB_UPPER', 'BB_LOWER', 'Mid']
 
-def write_chart(df, timeframe, outdir):    
+
+def write_chart(df, timeframe, outdir, plotter, manifest):    
     symbol = df.attrs['symbol']
-    print(f"Creating chart {symbol}: {df.index[0]} - {df.index[-1]}")    
     date = df.index[0]    
-    fig  = Plotter().intraday_chart(df, timeframe, symbol, title=f"{symbol} {date} ({timeframe})")
+    title = f"{symbol} {date} ({timeframe})"
     filepath =  f"{outdir}/{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" if outdir else f"{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" 
-    utils.write_file(fig, filepath, 'png', 1600, 900)
+    digest = chart_digest(df, chart='intraday', tf=timeframe, title=title, plot_config=plotter.plot_config, renderer=plotter.renderer)
+    if manifest.is_current(filepath, digest):
+        print(f"Chart {symbol}: '{filepath}.png' is up to date")
+        return
+    print(f"Creating chart {symbol}: {df.index[0]} - {df.index[-1]}")    
+    fig  = plotter.intraday_chart(df, timeframe, symbol, title=title)
+    plotter.write_image(fig, filepath, 1600, 900)
+    manifest.update({manifest.key(filepath): digest})
 
-def create_charts(symbols, start, end, timeframe, provider, outdir, path):
+def create_charts(symbols, start, end, timeframe, provider, outdir, path, force=False):
     dfs = []
     for symbol in symbols:
-        if provider == 'tv':
-            df = utils.get_dataframe_tv(start, timeframe, symbol, path)
-        elif provider == 'alpaca-file':
-            df = utils.get_dataframe_alpaca(symbol, timeframe, path)
-        elif provider == 'alpaca':
+        if provider == 'alpaca':
             df = utils.download_dataframe_alpaca(start, timeframe, symbol)
+            df = utils.filter_date(df, start, end)
         else:
-            raise ValueError(f"Unknown provider: {provider}")
-        
-        if start:        
-            df = df.loc[start:]
-        if end:        
-            df = df.loc[:end]                    
+            # Only the bars in [start, end] are read from the bar cache
+            df = utils.get_dataframe(provider, symbol, start, end, timeframe, path=path)
         if df.empty:
             #raise Exception(f"Empty DataFrame for symbol {symbol}")
             print(f"Skipping empty DataFrame for symbol '{symbol}'")
         else:
             dfs.append(df)    
 
+    plotter = Plotter(fast=True)
+    manifest = Manifest(outdir, force)
     for df in dfs:
-        write_chart(df, timeframe, outdir)
+        write_chart(df, timeframe, outdir, plotter, manifest)
+    manifest.save()
 
 
 # TODO: use partial decorator ? @functools.partial()
-def process_symbol(symbol, start, timeframe, provider, filetype, start_time, end_time, outdir, days, paths, ta_params):
-    if provider == 'tv':
-        df = utils.get_dataframe_tv(start, timeframe, symbol, paths['tv'])
-    elif provider == 'alpaca-file':
-        df = utils.get_dataframe_alpaca(symbol, timeframe, paths['alpaca-file'])
-    elif provider == 'alpaca':
+def process_symbol(symbol, start, timeframe, provider, filetype, start_time, end_time, outdir, days, paths, ta_params, renderer='plotly', manifest=None,
+                   render_threads=0):
+    """
+    Returns the manifest entries of the charts written. Charts current in 'manifest' are skipped.
+    render_threads: export the charts in this many threads while the next ones are built, 0 to export synchronously
+                    (or with the RenderPool installed in this process)
+    """
+    if provider == 'alpaca':
         df = utils.download_dataframe_alpaca(start, timeframe, symbol)  # TODO: not implemented
     else:
-        raise ValueError(f"Unknown provider: {provider}")
+        # Filtered by start date while loading, as views of the memory mapped bar cache
+        with instrument.timer('load', symbol):
+            df = utils.get_dataframe(provider, symbol, start, '', timeframe, path=paths[provider], copy=False)
 
     if df.empty:
         raise Exception(f"Empty DataFrame for symbol {symbol}")
 
-    if start != '':
-        print(f"{symbol}: filtering df by start date '{start}'")
-        df = df.loc[start:]
-
     print(f"{symbol}: Applying TA to {len(df)} rows")
 
     # TODO: add mid,vwap, daily/ah/pm levels and store in dataframe as constant values? and write test for it?
-    df = utils_ta.add_ta(symbol, df, ['EMA10', 'EMA20', 'EMA50', 'BB'], start_time, end_time)
+    # Only bars added since the previous run are computed
+    with instrument.timer('ta', symbol):
+        df = utils_ta.add_ta_cached(symbol, df, ['EMA10', 'EMA20', 'EMA50', 'BB'], start_time, end_time)
+        # VWAP and Mid of the RTH bars of every day at once, restarted each day, instead of per day chart
+        utils_ta.vwap(df, start_time, end_time)
+        utils_ta.mid(df, start_time, end_time)
 
     print(f"{symbol}: Splitting data into days")
-    eth_values = {}
-    dfs = utils.split(df, start_time, end_time, eth_values)
+    # Row ranges and levels of each day instead of a frame per day
+    with instrument.timer('split', symbol):
+        sessions = utils.sessions(df, start_time, end_time)
+    # Levels of each day, including the opening ranges, from the cached table of the full history
+    with instrument.timer('levels', symbol):
+        level_table = utils.get_levels(provider, symbol, timeframe, paths[provider], start_time, end_time)
     #TODO: days is not needed? (use start instead)
-    if days != 0:
-        dfs = dfs[-days:]
-
-    print(f"{symbol}: generating images for {len(dfs)} days")
-    for i in range(1, len(dfs)):
-        today = dfs[i]
-        yday = dfs[i - 1]
-        date = today.index.date[0]
-        levels = {
-            'close_1': yday['Close'].iloc[-1],
-            'high_1': yday['High'].max(),
-            'low_1': yday['Low'].min(),
-            'eth_low': eth_values[date]['low'],
-            'eth_high': eth_values[date]['high'],
-        }
-
-        utils_ta.vwap(today)
-        utils_ta.mid(today)
-
-        fig = Plotter().intraday_chart(
-            today,
-            timeframe,
-            symbol,
-            title=f"{symbol} {date} ({timeframe})",
-            plot_indicators={key: ta_params[key] for key in ['VWAP', 'EMA10', 'EMA20', 'EMA50', 'BB_UPPER', 'BB_LOWER', 'Mid']},
-            or_times=('09:30', '10:30'),
-            daily_levels=levels,
-        )
-        filepath =  f"{outdir}/{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" if outdir else f"{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" 
-        utils.write_file(fig, filepath, filetype, 1600, 900)
-
-    print("done")
-
-
-def create_charts_day_by_day(start, end, timeframe, provider, symbols, filetype, outdir, days, start_time, end_time, paths, ta_params):
+    # The first day of the last 'days' only provides the previous day levels
+    first = max(len(sessions) - days, 0) + 1 if days != 0 else 1
+
+    print(f"{symbol}: generating images for {max(len(sessions) - first, 0)} days")
+    # 'ta_params' sets the indicator colors
+    plotter = Plotter(plot_config={'ta_config': ta_params} if ta_params else None, fast=True, renderer=renderer)
+    written = {}
+    with RenderPool(render_threads, 'thread') if render_threads > 0 else nullcontext() as render_pool:
+        for i in range(first, len(sessions)):
+            today = df.iloc[sessions.rth_start[i]:sessions.rth_end[i]]
+            date = sessions.dates[i].item()
+            levels = utils.day_levels(level_table, date, DAY_LEVELS)
+
+            title = f"{symbol} {date} ({timeframe})"
+            filepath =  f"{outdir}/{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" if outdir else f"{symbol}-{date.strftime('%Y-%m-%d')}-{timeframe}" 
+            digest = chart_digest(today, chart='intraday', tf=timeframe, title=title, ta_indicators=DAY_TA, levels=levels,
+                                  plot_config=plotter.plot_config, renderer=plotter.renderer)
+            if manifest is not None and manifest.is_current(filepath, digest):
+                continue
+
+            key = manifest.key(filepath) if manifest is not None else filepath
+            with instrument.timer('figure', symbol, key):
+                fig = plotter.intraday_chart(
+                    today,
+                    timeframe,
+                    symbol,
+                    title=title,
+                    levels=levels,
+                    ta_indicators=DAY_TA,
+                )
+            with instrument.timer(render.export_stage(), symbol, key):
+                plotter.write_image(fig, filepath, 1600, 900)
+            if manifest is not None:
+                written[key] = digest
+    if render_pool is not None and manifest is not None:
+        # Only the charts actually written are current
+        manifest.discard(render_pool.failed, written)
+
+    print(f"{symbol}: done")
+    return written
+
+
+def create_charts_day_by_day(start, end, timeframe, provider, symbols, filetype, outdir, days, start_time, end_time, paths, ta_params=None, renderers=0,
+                             renderer='plotly', force=False, render_mode='process', report='', profile='', profiler='cprofile'):
+    """
+    ta_params: indicator colors, default plotter.TA_PARAMS
+    report: write the stage timings, cache hit rates and peak RSS of the run to this JSON file, see instrument.RunReport
+    profile: profile each symbol into this directory, with 'profiler' (see instrument.PROFILERS)
+    """
     if isinstance(symbols, tuple):
         symbols = list(symbols)
     elif ',' in symbols:
         symbols = symbols.split(',')
     else:
         symbols = [symbols]
-    with ProcessPoolExecutor() as executor:
+    run_report = instrument.RunReport(report, symbols=len(symbols), timeframe=timeframe, days=days, renderers=renderers, render_mode=render_mode,
+                                      renderer=renderer)
+    manifest = Manifest(outdir, force)
+    with ExitStack() as stack:
+        # With 'renderers' the workers only build figures and a shared RenderPool (or threads of each worker) exports them
+        render_queue = stack.enter_context(RenderPool(renderers, report=run_report, manifest=manifest)).queue if renderers > 0 and render_mode == 'process' else None
+        executor = stack.enter_context(ProcessPoolExecutor(initializer=render.install, initargs=(render_queue,)))
             # def func(symbol):
             #     try:
             #         return process_symbol(symbol, start=start, timeframe=timeframe, provider=provider, trades=trades, filetype=filetype, start_time=start_time, end_time=end_time, outdir=outdir)
@@ -118,7 +157,17 @@ def create_charts_day_by_day(start, end, timeframe, provider, symbols, filetype,
             #         traceback.print_exc()
             #         return None
         func = partial(
-                process_symbol, start=start, timeframe=timeframe, provider=provider, filetype=filetype, start_time=start_time, end_time=end_time, outdir=outdir, days=days, paths=paths, ta_params=ta_params
+                process_symbol, start=start, timeframe=timeframe, provider=provider, filetype=filetype, start_time=start_time, end_time=end_time, outdir=outdir, days=days, paths=paths, ta_params=ta_params,
+                renderer=renderer, manifest=manifest, render_threads=renderers if render_mode == 'thread' else 0
             )
         try_func = partial(try_process_symbol, func)
-        results = list(executor.map(try_func, symbols))
\ No newline at end of file
+        # Each task returns its timers and counters with its result, see instrument.collected
+        outcomes = list(executor.map(partial(instrument.collected, try_func, profile, profiler), symbols))
+        # Merged before the RenderPool is closed, which discards the entries of failed exports
+        for entries, data in outcomes:
+            run_report.add(data)
+            if entries:
+                manifest.update(entries)
+    print(f"Created {len(manifest.updates)} charts")
+    manifest.save()
+    print(instrument.summary(run_report.save()))
\ No newline at end of file
@@ -1,68 +1,167 @@
+from contextlib import ExitStack, nullcontext
+import math
+import os
+
+from trade_screenshots import instrument, render
+from trade_screenshots.common import try_process_symbol
+from trade_screenshots.manifest import Manifest, chart_digest
 from trade_screenshots.plotter import Plotter
+from trade_screenshots.render import RenderPool
 import trade_screenshots.utils as utils
 import trade_screenshots.utils_ta as utils_ta
 
 
 import pandas as pd
 
+TA_INDICATORS = ['EMA10', 'EMA20', 'EMA50', 'BB']
+# Minutes of a regular session, the fewest bars per day the TA warm-up can count on
+RTH_MINUTES = 390
+# Calendar days of the daily chart around the trade entry
+DAILY_DAYS_BEFORE = 100
+DAILY_DAYS_AFTER = 20
+
+
+def trade_window(trade, days):
+    # Dates included in the trade chart, as [start, end)
+    start_date = pd.to_datetime(trade.entry_date).normalize() - pd.Timedelta(days=days)
+    end_date = pd.to_datetime(trade.exit_date).normalize() + pd.Timedelta(days=days + 1)
+    return start_date, end_date
+
+
+def load_range(windows, timeframe):
+    """
+    Dates (start, end), as accepted by utils.get_dataframe, covering the trade 'windows' and the TA warm-up before the
+    first one. No bounds for timeframes above intraday.
+    """
+    minutes = utils.timeframe_minutes(timeframe)
+    if not minutes:
+        return '', ''
+    warmup = max(utils_ta.warmup_bars(name) for name in TA_INDICATORS)
+    # Trading days of warm-up bars, with weekends and a week of holidays on top
+    days = math.ceil(warmup * minutes / RTH_MINUTES)
+    start = min(start for start, _ in windows) - pd.Timedelta(days=math.ceil(days * 7 / 5) + 7)
+    end = max(end for _, end in windows) - pd.Timedelta(days=1)
+    return f"{start.date()}", f"{end.date()}"
+
+
+def load_symbol(symbol, start, timeframe, transform, provider, start_time, end_time, paths, rth, windows=None):
+    """
+    Load the bars of 'symbol' with TA. With 'windows' only the bars of those [start, end) ranges (plus warm-up) are read
+    and TA is only computed for them, otherwise for the full history using the indicator cache.
+    """
+    with instrument.timer('load', symbol):
+        if windows:
+            load_start, load_end = load_range(windows, transform or timeframe)
+            df = utils.get_dataframe(provider, symbol, load_start, load_end, timeframe, path=paths[provider])
+        elif provider == 'tv':
+            df = utils.get_dataframe(provider, symbol, start, '', timeframe, path=paths[provider])
+        else:
+            df = utils.get_dataframe(provider, symbol, '', '', timeframe, path=paths[provider])
+        if provider != 'tv' and rth:
+            df = utils.filter_rth(df)
+    if df.empty:
+        return df
+    if transform != '':
+        print(f"{symbol}: transforming df from {timeframe} to {transform}")
+        with instrument.timer('aggregate', symbol):
+            df = utils.transform_timeframe(df, timeframe, transform)
+    ta_times = ('', '') if rth else (start_time, end_time)
+    with instrument.timer('ta', symbol):
+        if windows:
+            print(f"{symbol}: Applying TA to {len(windows)} trade windows")
+            return utils_ta.add_ta_windows(symbol, df, TA_INDICATORS, windows, *ta_times)
+        print(f"{symbol}: Applying TA to {len(df)} rows")
+        return utils_ta.add_ta_cached(symbol, df, TA_INDICATORS, *ta_times)
+
+
 #TODO: fix config class like sip_handler
-def handle_trades(start, timeframe, transform, provider, trades_file, filetype, outdir, days, start_time, end_time, paths, ta_params, rth=True, gen_daily=True):
+def handle_trades(start, timeframe, transform, provider, trades_file, filetype, outdir, days, start_time, end_time, paths, ta_params=None, rth=True, gen_daily=True,
+                  ta_windows=True, renderer='plotly', force=False,
+                  renderers=0, render_mode='thread', report='', profile='', profiler='cprofile'):
+    """
+    ta_windows: only compute TA around the trades (sparse trade logs), otherwise over the full history of each symbol
+    renderer: image backend, see render.RENDERERS
+    force: recreate charts even if their inputs are unchanged since the last run, see manifest.Manifest
+    renderers: number of image export workers (render_mode 'thread' or 'process'), 0 to export synchronously
+    report: write the stage timings, cache hit rates and peak RSS of the run to this JSON file, see instrument.RunReport
+    profile: profile the run into this directory, with 'profiler' (see instrument.PROFILERS)
+    """
+    run_report = instrument.RunReport(report, trades_file=trades_file, timeframe=timeframe, transform=transform, renderers=renderers,
+                                      render_mode=render_mode, renderer=renderer)
     trades = utils.parse_trades(trades_file)
-    symbols = list(set([trade.symbol for trade in trades]))
+    # Create all charts of one symbol before loading the next, so only the frames of one symbol are in memory
+    trades_by_symbol = {}
+    for trade in trades:
+        trades_by_symbol.setdefault(trade.symbol, []).append(trade)
 
-    dfs_map = {}
-    dfs_daily_map = {}
-    for symbol in symbols:
-        if provider == 'tv':
-            df = utils.get_dataframe_tv(start, timeframe, symbol, paths['tv'])
-        else:
-            df = utils.get_dataframe_alpaca(symbol, timeframe, paths['alpaca-file'])
-            if rth:
-                df = utils.filter_rth(df)
-            if gen_daily:
-                daily_df = utils.get_dataframe_alpaca(symbol, 'day', paths['alpaca-file'])
+    plotter = Plotter(plot_config={'ta_config': ta_params} if ta_params else None, fast=True, renderer=renderer)
+    manifest = Manifest(outdir, force)
+    plot_indicators = ['EMA10', 'EMA20', 'EMA50', 'BB_UPPER', 'BB_LOWER']
+
+    def process_symbol(symbol):
+        symbol_trades = trades_by_symbol[symbol]
+        windows = [trade_window(trade, days) for trade in symbol_trades] if ta_windows else None
+        df = load_symbol(symbol, start, timeframe, transform, provider, start_time, end_time, paths, rth, windows)
         if df.empty:
             print(f"Empty DataFrame for symbol {symbol}. Skipping")
-        else:
-            if transform != '':
-                print(f"{symbol}: transforming df from {timeframe} to {transform}")
-                df = utils.transform_timeframe(df, timeframe, transform)
-            print(f"{symbol}: Applying TA to {len(df)} rows")
-            if rth:
-                df = utils_ta.add_ta(symbol, df, ['EMA10', 'EMA20', 'EMA50', 'BB'])
-            else: 
-                df = utils_ta.add_ta(symbol, df, ['EMA10', 'EMA20', 'EMA50', 'BB'], start_time, end_time)
-            dfs_map[symbol] = df
+            return
+        if gen_daily:
+            with instrument.timer('load', symbol):
+                # Only the days shown on the daily charts of the symbol's trades
+                daily_start = min(trade.entry_date for trade in symbol_trades) - pd.Timedelta(days=DAILY_DAYS_BEFORE)
+                daily_end = max(trade.entry_date for trade in symbol_trades) + pd.Timedelta(days=DAILY_DAYS_AFTER)
+                daily_df = utils.get_dataframe(provider, symbol, f"{daily_start.date()}", f"{daily_end.date()}", 'day', path=paths[provider])
+
+        for trade in symbol_trades:
+            start_date, end_date = trade_window(trade, days)
+            with instrument.timer('slice', symbol):
+                trade_df = df.loc[start_date:end_date - pd.Timedelta(microseconds=1)]
+            title = f"{trades_file}-{trade.symbol}-{trade.entry_date:%Y-%m-%d}"
+            # format date like "2023-01-01_1500"
+            date_suffix = trade.entry_date.strftime('%Y-%m-%d_%H%M')
+            filename = f"{outdir}/{trade.symbol}-{date_suffix}-{timeframe}"
+            digest = chart_digest(trade_df, chart='trade', trade=trade, tf=timeframe, title=title, plot_indicators=plot_indicators,
+                                  plot_config=plotter.plot_config, renderer=plotter.renderer)
+            if not manifest.is_current(filename, digest):
+                key = manifest.key(filename)
+                with instrument.timer('figure', symbol, key):
+                    fig = plotter.trade_chart(
+                            trade,
+                            trade_df,
+                            tf=timeframe,
+                            title=title,
+                            plot_indicators=plot_indicators,
+                        )
+                with instrument.timer(render.export_stage(), symbol, key):
+                    plotter.write_image(fig, filename, 1600, 900)
+                manifest.update({key: digest})
+
+            #if config.gen_daily:
             if gen_daily:
-                dfs_daily_map[symbol] = daily_df
+                date = trade.entry_date
+                start_date = date - pd.Timedelta(days=DAILY_DAYS_BEFORE)
+                end_date = date + pd.Timedelta(days=DAILY_DAYS_AFTER)
+                daily_chart_df = daily_df.loc[f"{start_date}":f"{end_date}"]
+                title = f"{trade.symbol} {date} (daily)"
+                filename = f"{outdir}/{trade.symbol}-{date_suffix}-daily"
+                digest = chart_digest(daily_chart_df, chart='daily', title=title, sip_date=date, plot_config=plotter.plot_config, renderer=plotter.renderer)
+                if not manifest.is_current(filename, digest):
+                    key = manifest.key(filename)
+                    with instrument.timer('figure', symbol, key):
+                        fig = plotter.daily_chart(daily_chart_df, trade.symbol, title=title, sip_date=date)
+                    with instrument.timer(render.export_stage(), symbol, key):
+                        plotter.write_image(fig, filename, 1600, 900)
+                    manifest.update({key: digest})
 
-    # last 10 trades:
-    #trades = trades[-10:]
-    for trade in trades:
-        df = dfs_map[trade.symbol]
-        start_date = pd.to_datetime(trade.entry_date).date() - pd.Timedelta(days=days)
-        end_date = pd.to_datetime(trade.exit_date).date() + pd.Timedelta(days=days)
-        df = df.loc[f"{start_date}":f"{end_date}"]        
-        fig = Plotter().trade_chart(
-                trade,
-                df,
-                tf=timeframe,
-                title=f"{trades_file}-{trade.symbol}-{trade.entry_date[0:10]}",
-                plot_indicators=['EMA10', 'EMA20', 'EMA50', 'BB_UPPER', 'BB_LOWER'],
-                config=ta_params,
-            )
-            # format date like "2023-01-01_1500"        
-        date_suffix = trade.entry_date[:16].replace(' ', '_').replace(':', '')
-        utils.write_file(fig, f"{outdir}/{trade.symbol}-{date_suffix}-{timeframe}", filetype, 1600, 900)
-
-        #if config.gen_daily:
-        if gen_daily:
-            daily_df = dfs_daily_map[trade.symbol]
-            daily_days_before = 100
-            daily_days_after = 20
-            date = pd.to_datetime(trade.entry_date)
-            start_date = date - pd.Timedelta(days=daily_days_before)
-            end_date = date + pd.Timedelta(days=daily_days_after)
-            daily_chart_df = daily_df.loc[f"{start_date}":f"{end_date}"]
-            fig = Plotter().daily_chart(daily_chart_df, trade.symbol, title=f"{trade.symbol} {date} (daily)", sip_date=date)
-            utils.write_file(fig, f"{outdir}/{trade.symbol}-{date_suffix}-daily", filetype, 1600, 900)
\ No newline at end of file
+    with ExitStack() as stack:
+        if profile:
+            stack.enter_context(instrument.profiled(os.path.join(profile, 'trades'), profiler))
+        # With 'renderers' the charts are exported by a RenderPool while the next ones are built, the entries of failed
+        # exports are dropped from the manifest when it is closed
+        stack.enter_context(RenderPool(renderers, render_mode, report=run_report, manifest=manifest) if renderers > 0 else nullcontext())
+        # One symbol failing (missing or bad data) doesn't abort the rest of the trade log
+        for symbol in trades_by_symbol:
+            try_process_symbol(process_symbol, symbol)
+    print(f"Created {len(manifest.updates)} charts")
+    manifest.save()
+    print(instrument.summary(run_report.save()))
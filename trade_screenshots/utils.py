@@ -2,15 +2,21 @@ from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 from functools import reduce
+import importlib.util
 import json
 import logging
 from multiprocessing import Pool
 import os
+import re
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
-import plotly.io as pio
 from finta import TA
 from typing import Any, Callable, List, Dict, Optional, Tuple, Union
 
+from trade_screenshots import cache, render
+
 
 logger = logging.getLogger(__name__)
 
@@ -20,12 +26,16 @@ logger = logging.getLogger(__name__)
 @dataclass
 class Trade:
     symbol: str
-    entry_date: str
-    exit_date: str
+    entry_date: pd.Timestamp
+    exit_date: pd.Timestamp
     pnl: Decimal
     value: Decimal
     entry_price: Decimal
     exit_price: Decimal
+    # Not in the trade log csv, shown in the trade chart annotations when set
+    quantity: Optional[Decimal] = None
+    long_short: str = ''
+    comment: str = ''
 
 def parse_trades(csv_file: str) -> List[Trade]:
     trades = []
@@ -33,10 +43,10 @@ def parse_trades(csv_file: str) -> List[Trade]:
         for line in f.readlines()[1:]:
             row = line.split(',')
             try:
-                # start_dt = datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S')
-                # end_dt = datetime.strptime(row[4], '%Y-%m-%d %H:%M:%S')
+                value = Decimal(row[6])
                 trades.append(
-                    Trade(symbol=row[2], entry_date=row[3], exit_date=row[4], pnl=Decimal(row[5]), value=Decimal(row[6]), entry_price=Decimal(row[7]), exit_price=Decimal(row[8]))
+                    Trade(symbol=row[2], entry_date=pd.Timestamp(row[3]), exit_date=pd.Timestamp(row[4]), pnl=Decimal(row[5]), value=value,
+                          entry_price=Decimal(row[7]), exit_price=Decimal(row[8]), long_short='SHORT' if value < 0 else 'LONG')
                 )
             except Exception as e:
                 print(f"Error parsing trade: {e}")
@@ -87,35 +97,223 @@ def download_dataframe_alpaca(start: str, timeframe: str, symbol: str) -> pd.Dat
     return pd.DataFrame()
 
 
+# Bar segments of a trading day, in time order so (session, segment) is sorted with the bars
+SEGMENT_OVERNIGHT = 0  # before the pre-market
+SEGMENT_PM = 1
+SEGMENT_RTH = 2
+SEGMENT_AH = 3  # up to and including AH_END
+SEGMENT_LATE = 4
+N_SEGMENTS = 5
+PM_START = '04:00'
+AH_END = '20:00'
+
+
+def time_of_day_ns(time: str) -> int:
+    return pd.Timestamp(f"1970-01-01 {time}").value
+
+
+def session_segments(index: pd.DatetimeIndex, start_time: str, end_time: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Label each bar of the sorted 'index' with its session id (0, 1, ... for each calendar date with bars) and its
+    segment (SEGMENT_*), RTH being [start_time, end_time)
+    """
+    ts = pd.DatetimeIndex(index).as_unit('ns').asi8
+    day = ts // NS_PER_DAY
+    time_of_day = ts - day * NS_PER_DAY
+    session = np.cumsum(np.concatenate(([0], day[1:] != day[:-1])))
+    conditions = [time_of_day < time_of_day_ns(PM_START), time_of_day < time_of_day_ns(start_time), time_of_day < time_of_day_ns(end_time),
+                  time_of_day <= time_of_day_ns(AH_END)]
+    segment = np.select(conditions, [SEGMENT_OVERNIGHT, SEGMENT_PM, SEGMENT_RTH, SEGMENT_AH], SEGMENT_LATE).astype(np.int8)
+    return session, segment
+
+
+def _reduce_ranges(ufunc: np.ufunc, values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # ufunc reduction of each (sorted, non overlapping) row range [start, end), NaN for empty ranges
+    out = np.full(len(starts), np.nan)
+    if len(values) == 0 or len(starts) == 0:
+        return out
+    # NaN sentinel so ends may equal len(values), fmin/fmax skip it
+    reduced = ufunc.reduceat(np.append(values, np.nan), np.column_stack([starts, ends]).ravel())[::2]
+    nonempty = ends > starts
+    out[nonempty] = reduced[nonempty]
+    return out
+
+
+@dataclass
+class Sessions:
+    """
+    Per trading day with RTH bars: its date, the row range [rth_start, rth_end) of the RTH bars, the ETH low/high (the
+    previous day's after-hours and the pre-market) and the previous RTH session's close/high/low (NaN for the first)
+    """
+    dates: np.ndarray
+    rth_start: np.ndarray
+    rth_end: np.ndarray
+    eth_low: np.ndarray
+    eth_high: np.ndarray
+    close_1: np.ndarray
+    high_1: np.ndarray
+    low_1: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+def sessions(df: pd.DataFrame, start_time: str, end_time: str) -> Sessions:
+    """
+    Sessions of the (sorted) bars 'df' in one pass over the session_segments() labels, RTH being [start_time, end_time).
+    The RTH bars of session i are df.iloc[rth_start[i]:rth_end[i]].
+    """
+    session, segment = session_segments(df.index, start_time, end_time)
+    n_sessions = int(session[-1]) + 1 if len(session) else 0
+    key = session * N_SEGMENTS + segment
+    first_keys = np.arange(n_sessions) * N_SEGMENTS
+
+    def segment_rows(seg):
+        return np.searchsorted(key, first_keys + seg, 'left'), np.searchsorted(key, first_keys + seg, 'right')
+
+    low = df['Low'].to_numpy(dtype=np.float64)
+    high = df['High'].to_numpy(dtype=np.float64)
+    close = df['Close'].to_numpy(dtype=np.float64)
+    pm_start, pm_end = segment_rows(SEGMENT_PM)
+    ah_start, ah_end = segment_rows(SEGMENT_AH)
+    rth_start, rth_end = segment_rows(SEGMENT_RTH)
+    # After-hours of the previous calendar date with bars
+    prev_ah_low = np.concatenate(([np.nan], _reduce_ranges(np.fmin, low, ah_start, ah_end)[:-1]))
+    prev_ah_high = np.concatenate(([np.nan], _reduce_ranges(np.fmax, high, ah_start, ah_end)[:-1]))
+    eth_low = np.fmin(prev_ah_low, _reduce_ranges(np.fmin, low, pm_start, pm_end))
+    eth_high = np.fmax(prev_ah_high, _reduce_ranges(np.fmax, high, pm_start, pm_end))
+
+    has_rth = rth_end > rth_start
+    rth_start, rth_end = rth_start[has_rth], rth_end[has_rth]
+    rth_low = _reduce_ranges(np.fmin, low, rth_start, rth_end)
+    rth_high = _reduce_ranges(np.fmax, high, rth_start, rth_end)
+    rth_close = close[rth_end - 1] if len(rth_end) else np.array([])
+    days = (pd.DatetimeIndex(df.index).as_unit('ns').asi8[rth_start] // NS_PER_DAY).astype('datetime64[D]')
+
+    def previous(values):
+        return np.concatenate(([np.nan], values[:-1])) if len(values) else values
+
+    return Sessions(dates=days, rth_start=rth_start, rth_end=rth_end, eth_low=eth_low[has_rth], eth_high=eth_high[has_rth],
+                    close_1=previous(rth_close), high_1=previous(rth_high), low_1=previous(rth_low))
+
+
 def split(df: pd.DataFrame, start_time: str, end_time: str, eth_values: Dict[str, Dict[str, Union[float, str]]]) -> List[pd.DataFrame]:
-    start = pd.to_datetime(start_time).time()
-    end = pd.to_datetime(end_time).time()
+    """
+    The RTH bars of each day (as slices of 'df') and their ETH low/high in 'eth_values' by date, see sessions()
+    """
+    table = sessions(df, start_time, end_time)
+    for date, low, high in zip(table.dates.tolist(), table.eth_low.tolist(), table.eth_high.tolist()):
+        eth_values[date] = {'low': low, 'high': high}
+    return [df.iloc[start:end] for start, end in zip(table.rth_start, table.rth_end)]
+
+
+# Columns of levels_table() besides its or_columns(), the names are the Plotter.intraday_chart() level keys where it draws them
+LEVEL_COLUMNS = ['close_1', 'high_1', 'low_1', 'yday_mid', 'eth_low', 'eth_high', 'rth_high', 'rth_low', 'today_mid', 'or_high', 'or_low']
+# Opening range, inclusive like utils_ta.or_levels
+OR_TIMES = ('09:30', '10:30')
+# Opening range windows in minutes after the RTH start, see opening_ranges()
+OR_WINDOWS = (5, 15, 30, 60)
+
+
+def or_columns(windows: Tuple[int, ...] = OR_WINDOWS) -> List[str]:
+    return [f"or{window}_{side}" for window in sorted(windows) for side in ('high', 'low')]
+
+
+def opening_ranges(df: pd.DataFrame, dates: np.ndarray, start_time: str = '09:30', windows: Tuple[int, ...] = OR_WINDOWS) -> Dict[str, np.ndarray]:
+    """
+    High/low of the bars starting within 'windows' minutes after 'start_time' on each of 'dates' (datetime64[D]), as
+    or_columns(). Windows no bar starts in are NaN, e.g. the 5min window of hourly bars starting at 09:00.
+
+    All windows are a single reduction over the consecutive row ranges between the window ends, the larger windows
+    accumulating the smaller ones.
+    """
+    windows = sorted(windows)
+    ts = pd.DatetimeIndex(df.index).as_unit('ns').asi8
+    opens = dates.astype('datetime64[ns]').view(np.int64) + time_of_day_ns(start_time)
+    offsets = np.array([0] + [window * NS_PER_MINUTE for window in windows], dtype=np.int64)
+    bounds = np.searchsorted(ts, opens[:, None] + offsets, 'left')
+    starts, ends = bounds[:, :-1].ravel(), bounds[:, 1:].ravel()
+    high = np.fmax.accumulate(_reduce_ranges(np.fmax, df['High'].to_numpy(dtype=np.float64), starts, ends).reshape(-1, len(windows)), axis=1)
+    low = np.fmin.accumulate(_reduce_ranges(np.fmin, df['Low'].to_numpy(dtype=np.float64), starts, ends).reshape(-1, len(windows)), axis=1)
+    columns = {}
+    for i, window in enumerate(windows):
+        columns[f"or{window}_high"] = high[:, i]
+        columns[f"or{window}_low"] = low[:, i]
+    return columns
+
+
+def levels_table(df: pd.DataFrame, start_time: str = '09:30', end_time: str = '16:00', or_times: Tuple[str, str] = OR_TIMES,
+                 or_windows: Tuple[int, ...] = OR_WINDOWS) -> pd.DataFrame:
+    """
+    One row per session of sessions() indexed by its date: the previous session's close/high/low/mid, the ETH range,
+    the RTH high/low/mid, the opening range high/low and the opening_ranges() of 'or_windows'
+    """
+    table = sessions(df, start_time, end_time)
+    low = df['Low'].to_numpy(dtype=np.float64)
+    high = df['High'].to_numpy(dtype=np.float64)
+    ts = pd.DatetimeIndex(df.index).as_unit('ns').asi8
+    day_ns = table.dates.astype('datetime64[ns]').view(np.int64)
+    or_start = np.searchsorted(ts, day_ns + time_of_day_ns(or_times[0]), 'left')
+    or_end = np.searchsorted(ts, day_ns + time_of_day_ns(or_times[1]), 'right')
+    rth_high = _reduce_ranges(np.fmax, high, table.rth_start, table.rth_end)
+    rth_low = _reduce_ranges(np.fmin, low, table.rth_start, table.rth_end)
+    columns = {
+        'close_1': table.close_1,
+        'high_1': table.high_1,
+        'low_1': table.low_1,
+        'yday_mid': (table.high_1 + table.low_1) / 2,
+        'eth_low': table.eth_low,
+        'eth_high': table.eth_high,
+        'rth_high': rth_high,
+        'rth_low': rth_low,
+        'today_mid': (rth_high + rth_low) / 2,
+        'or_high': _reduce_ranges(np.fmax, high, or_start, or_end),
+        'or_low': _reduce_ranges(np.fmin, low, or_start, or_end),
+        **opening_ranges(df, table.dates, start_time, or_windows),
+    }
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(table.dates.astype('datetime64[ns]'), name='date'), columns=LEVEL_COLUMNS + or_columns(or_windows))
+
+
+def get_levels(provider: str, symbol: str, timeframe: str, path: str, start_time: str = '09:30', end_time: str = '16:00',
+               or_times: Tuple[str, str] = OR_TIMES, or_windows: Tuple[int, ...] = OR_WINDOWS, use_cache: bool = True) -> pd.DataFrame:
+    """
+    levels_table() of the full bar history of 'symbol', cached with its bars and rebuilt when the bar file changes
+    """
+    def load():
+        df = get_dataframe(provider, symbol, '', '', timeframe, path=path, use_cache=use_cache, copy=False)
+        return levels_table(df, start_time, end_time, or_times, or_windows)
+
+    source = bars_path(provider, symbol, timeframe, path)
+    if not use_cache or source is None:
+        return load()
+    windows = '_'.join(str(window) for window in sorted(or_windows))
+    group = re.sub(r'[^0-9A-Za-z_-]', '', f"{timeframe}-{start_time}-{end_time}-or{or_times[0]}-{or_times[1]}-w{windows}")
+    return cache.cached_table(cache.levels_cache_dir(source, group), source, load)
+
+
+def day_levels(levels: pd.DataFrame, date: Any, keys: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    The 'keys' levels (default all) of the session on 'date' in a levels_table(), without the missing (NaN) ones. Empty
+    if there was no session that day.
+    """
+    try:
+        i = levels.index.get_loc(pd.Timestamp(date).normalize())
+    except KeyError:
+        return {}
+    row = {key: float(levels[key].to_numpy()[i]) for key in (keys if keys is not None else levels.columns)}
+    return {key: value for key, value in row.items() if not np.isnan(value)}
 
-    dfs = []
-    ah_df = None
-    for date, group_df in df.groupby(df.index.date):
-        filtered_df = group_df.between_time(start_time, end_time, inclusive='left')
-        pm_df = group_df.between_time('04:00', start_time, inclusive='left')
-        if not filtered_df.empty:
-            dfs.append(filtered_df)
-            if ah_df is not None:
-                eth_df = pd.concat([ah_df, pm_df])
-            else:
-                eth_df = pm_df
-            eth_values[date] = {'low': eth_df['Low'].min(), 'high': eth_df['High'].max()}
-
-        ah_df = group_df.between_time(end_time, '20:00')
-    return dfs
 
 #TODO: part of Plotter class? (not expose and utils functions from this lib?)
-def write_file(fig: Any, filename: str, width: int, height: int, verbose=0) -> str:
-    dirs = filename.split('/')
-    if len(dirs) > 1:
-        dir_path = '/'.join(dirs[:-1])
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-   
-    pio.write_image(fig, f"{filename}.png", width=width, height=height)
+def write_file(fig: Any, filename: str, width: int, height: int, verbose=0, renderer: str = 'plotly') -> str:
+    """
+    renderer: see render.RENDERERS
+    """
+    render.makedirs(os.path.dirname(filename))
+    if render.submit(fig, f"{filename}.png", width, height, renderer):
+        # Exported asynchronously by the installed RenderPool
+        return f"{filename}.png"
+    render.write_image(fig, f"{filename}.png", width, height, renderer)
     if verbose > 0:
         print(f"Wrote '{filename}.png'")
     
@@ -185,16 +383,62 @@ def parse_txt(filename: str) -> Dict[str, pd.Timestamp]:
 
 
 ################### https://github.com/fbjarkes/python-utils.git
-def transform_timeframe(df: pd.DataFrame, timeframe: str, transform: str) -> pd.DataFrame:
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def bucket_resample(df: pd.DataFrame, width_ns: int, offset_ns: int = 0) -> pd.DataFrame:
+    """
+    Aggregate the OHLCV bars of 'df' into buckets of 'width_ns' starting at midnight of the first day plus 'offset_ns'
+    (same bucket labels as resample(origin='start_day', offset=...)). Bucket ids are computed from the int64 timestamps and
+    the columns aggregated with ufunc.reduceat over the existing bars only, so gaps (nights, weekends) cost nothing.
+    """
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    df = df[OHLCV_COLUMNS].dropna()
+    if df.empty:
+        return df
+    times = pd.DatetimeIndex(df.index).as_unit('ns').asi8
+    origin = times[0] - times[0] % NS_PER_DAY + offset_ns
+    buckets = (times - origin) // width_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    resampled = pd.DataFrame({
+        'Open': df['Open'].to_numpy()[starts],
+        'High': np.maximum.reduceat(df['High'].to_numpy(), starts),
+        'Low': np.minimum.reduceat(df['Low'].to_numpy(), starts),
+        'Close': df['Close'].to_numpy()[ends],
+        'Volume': np.add.reduceat(df['Volume'].to_numpy(), starts),
+    }, index=pd.DatetimeIndex((origin + buckets[starts] * width_ns).view('datetime64[ns]'), name=df.index.name))
+    resampled.attrs = dict(df.attrs)
+    return resampled
+
+
+def transform_timeframe(df: pd.DataFrame, timeframe: str, transform: str, engine: str = 'bucket', anchor: str = '') -> pd.DataFrame:
+    """
+    engine: 'bucket' (see bucket_resample) for '<n>min' and 'day' transforms, or 'resample' for pandas resample. Week and
+            month transforms always use resample.
+    anchor: session anchored intraday buckets, e.g. '09:30' for 60min bars starting at 09:30, 10:30, ...
+    """
     if timeframe == transform or df.empty:
         return df
+    offset = pd.Timedelta(f"{anchor}:00") if anchor else pd.Timedelta(0)
+    minutes = timeframe_minutes(transform)
+    if engine == 'bucket' and (minutes or transform == 'day'):
+        width = minutes * NS_PER_MINUTE if minutes else NS_PER_DAY
+        resampled = bucket_resample(df, width, offset.value if minutes else 0)
+        resampled.attrs['timeframe'] = transform
+        return resampled
     conversion = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
     if timeframe == 'day' and transform == 'month':
         resampled = df.resample('ME').agg(conversion)
     elif timeframe == 'day' and transform == 'week':
         resampled = df.resample('W').agg(conversion)
+    elif transform == 'day':
+        resampled = df.resample('D').agg(conversion)
     else:
-        resampled = df.resample(f"{transform}").agg(conversion)
+        resampled = df.resample(f"{transform}", offset=offset).agg(conversion)
     resampled.attrs['timeframe'] = transform
     return resampled.dropna()
 
@@ -207,6 +451,48 @@ def filter_rth(df: pd.DataFrame, start_time='09:30', end_time='16:00') -> pd.Dat
         return df
 
 
+# Daily bars are derived from the regular trading hours, which only bars of a divisor of 30 minutes split exactly
+RTH_BAR_MINUTES = 30
+
+
+def timeframe_minutes(timeframe: str) -> Optional[int]:
+    match = re.fullmatch(r'(\d+)min', timeframe)
+    return int(match.group(1)) if match else None
+
+
+def can_derive_daily(timeframe: str) -> bool:
+    minutes = timeframe_minutes(timeframe)
+    return minutes is not None and RTH_BAR_MINUTES % minutes == 0
+
+
+def derive_timeframes(df: pd.DataFrame, timeframe: str, targets: List[str], anchor: str = '') -> Dict[str, pd.DataFrame]:
+    """
+    Timeframe pyramid: aggregate 'df' (in 'timeframe') once to each of the 'targets' ('<n>min' or 'day'). Each level is
+    built from the highest level already derived that it is a multiple of, e.g. 15min from 5min instead of the 1min base.
+    'day' bars are built from the regular trading hours, and left out if 'timeframe' can't be split at 09:30/16:00.
+    Returns the levels by timeframe, including 'timeframe' itself.
+
+    anchor: see transform_timeframe, applied to the intraday levels
+    """
+    levels = {timeframe: df}
+    anchor_minutes = pd.Timedelta(f"{anchor}:00").value // NS_PER_MINUTE if anchor else 0
+
+    def source_for(minutes: int) -> str:
+        # Bars of the source level must not straddle the bucket bounds of the new level
+        divisors = [tf for tf in levels if timeframe_minutes(tf) and minutes % timeframe_minutes(tf) == 0
+                    and anchor_minutes % timeframe_minutes(tf) == 0]
+        return max(divisors, key=timeframe_minutes, default=timeframe)
+
+    for tf in sorted({tf for tf in targets if timeframe_minutes(tf)}, key=timeframe_minutes):
+        if tf not in levels:
+            source = source_for(timeframe_minutes(tf))
+            levels[tf] = transform_timeframe(levels[source], source, tf, anchor=anchor)
+    if 'day' in targets and 'day' not in levels and can_derive_daily(timeframe):
+        source = source_for(RTH_BAR_MINUTES)
+        levels['day'] = transform_timeframe(filter_rth(levels[source]), source, 'day')
+    return levels
+
+
 def filter_date(df: pd.DataFrame, start: str, end: str) -> pd.DataFrame:
     if start and end and not df.empty:
         df = df[start:end]
@@ -214,30 +500,105 @@ def filter_date(df: pd.DataFrame, start: str, end: str) -> pd.DataFrame:
     if end and not df.empty:
         df = df[:end]
         return df
+    if start and not df.empty:
+        df = df[start:]
+        return df
     return df
 
 
-def get_dataframe_tv(timeframe: str, symbol: str, path: str, tz='America/New_York', include_all_columns: bool = True) -> Union[pd.DataFrame, None]:
-    file_path = f"{path}/{timeframe}/{symbol}.csv"
+def date_bounds(start: str, end: str, transform: str = '') -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+    """
+    Convert 'start'/'end' (as accepted by filter_date) to a [start, end) range covering at least the same rows, so a
+    provider can read only that part of the data before filter_date does the exact slicing.
+    transform: timeframe the bars are aggregated to after loading (see transform_timeframe). The range is widened to
+               whole periods of it, so the first and last aggregated bars are complete. No bounds for '<n>min' buckets
+               not dividing a day, as those depend on the first bar of the data.
+    """
+    lower = pd.Timestamp(start).normalize() if start else None
+    upper = pd.Timestamp(end).normalize() + pd.Timedelta(days=1) if end else None
+    minutes = timeframe_minutes(transform)
+    if minutes and NS_PER_DAY % (minutes * NS_PER_MINUTE):
+        return None, None
+    # Weeks (labelled by their Sunday) and months (by their last day) end at or before a bucket label <= 'end', so
+    # only the lower bound moves
+    if lower is not None and transform == 'week':
+        lower -= pd.Timedelta(days=lower.weekday())
+    elif lower is not None and transform == 'month':
+        lower = lower.replace(day=1)
+    return lower, upper
+
+
+TV_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'Volume']
+
+
+def bars_path(provider: str, symbol: str, timeframe: str, path: str) -> Optional[str]:
+    """
+    The bar file of 'symbol' for the file based providers, None for others
+    """
+    if provider == 'tv':
+        return os.path.expanduser(f"{path}/{timeframe}/{symbol}.csv")
+    if provider == 'ib':
+        return os.path.expanduser(os.path.join(path, timeframe, f"{symbol}.csv"))
+    if provider == 'alpaca-file':
+        return os.path.expanduser(f"{path}{os.sep}{timeframe}{os.sep}{symbol}.json")
+    return None
+
+
+def read_tv_csv(file_path: str, tz='America/New_York', include_all_columns: bool = True, columns: Optional[List[str]] = None,
+                float_dtype=np.float64, engine: Optional[str] = None) -> pd.DataFrame:
+    """
+    Parse a TradingView export with explicit dtypes: int64 epoch seconds for 'time' and 'float_dtype' for the OHLCV
+    (and the extra 'columns' if not 'include_all_columns'). Duplicate timestamps are dropped (keeping the first) and
+    the result is sorted by time.
+
+    engine: pandas read_csv engine, e.g. 'pyarrow' (optional dependency, falls back to the default engine if not installed)
+    """
+    if engine == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+        logger.warning("pyarrow not installed, using the default csv engine")
+        engine = None
+    usecols = None if include_all_columns else TV_COLUMNS + [col for col in (columns or []) if col not in TV_COLUMNS]
+    dtype = {col: float_dtype for col in (usecols or TV_COLUMNS)}
+    dtype['time'] = np.int64
+    df = pd.read_csv(file_path, usecols=usecols, dtype=dtype, engine=engine)
+
+    index = pd.to_datetime(df.pop('time').to_numpy(), unit='s', utc=True)
+    index = index.tz_convert(tz).tz_localize(None) if tz else index.tz_localize(None)
+    times = index.as_unit('ns').asi8
+    if not (np.diff(times) > 0).all():
+        # Sorted unique (local) times and the first row of each
+        times, first = np.unique(times, return_index=True)
+        df = df.iloc[first]
+    df.index = pd.DatetimeIndex(times.view('datetime64[ns]'), name='time')
+    return df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close'})
+
+
+def get_dataframe_tv(timeframe: str, symbol: str, path: str, tz='America/New_York', include_all_columns: bool = True,
+                     columns: Optional[List[str]] = None, float_dtype=np.float64, engine: Optional[str] = None, use_cache: bool = True,
+                     start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None, copy: bool = True) -> Union[pd.DataFrame, None]:
+    """
+    Load bars within [start, end), see read_tv_csv. With 'use_cache' the parsed columns are stored in the columnar cache
+    (separately for each column selection) and only the requested rows are read from it, without 'copy' as read only
+    memory mapped views.
+    """
+    file_path = bars_path('tv', symbol, timeframe, path)
     logger.debug(f"{symbol}: parsing tradingview data '{file_path}'")
-    default_cols = ['time', 'open', 'high', 'low', 'close', 'Volume']
+
+    def load():
+        df = read_tv_csv(file_path, tz, include_all_columns, columns, float_dtype, engine)
+        df.attrs = {'symbol': symbol, 'timeframe': timeframe}
+        logger.debug(f"{symbol}: {len(df)} rows (start={df.index[0]}, end={df.index[-1]})")
+        return df
+
     try:
-        if include_all_columns:
-            df = pd.read_csv(file_path, index_col='time', parse_dates=False)
-        else:
-            df = pd.read_csv(file_path, index_col='time', parse_dates=False, usecols=default_cols)
-        if tz:
-            df.index = pd.to_datetime(df.index, unit='s', utc=True).tz_convert(tz).tz_localize(None)
+        if use_cache:
+            selection = 'all' if include_all_columns else '+'.join(['ohlcv', *(columns or [])])
+            variant = f"{selection}-{np.dtype(float_dtype).name}-{tz.replace('/', '_') if tz else 'UTC'}"
+            df = cache.cached(file_path, load, start, end, variant=variant, copy=copy)
         else:
-            df.index = pd.to_datetime(df.index, unit='s', utc=True).tz_localize(None)
-        df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close'}, inplace=True)
-        df.attrs = {'symbol': symbol, 'timeframe': timeframe}
-        duplicates = df.index.duplicated(keep='first')
-        dupe_count = duplicates.sum()
-        if dupe_count > 0:
-            # remove duplicate rows
-            df = df[~duplicates]
-        logger.debug(f"{symbol}: {len(df)} rows (start={df.index[0]}, end={df.index[-1]} dupes={dupe_count}) ")
+            df = load()
+            lo, hi = cache.row_range(df.index.asi8, start, end)
+            df = df.iloc[lo:hi]
+        df.attrs['source'] = file_path
         return df
     except Exception as e:
         logger.warning(f"Error parsing csv '{path}': {e}")
@@ -245,7 +606,7 @@ def get_dataframe_tv(timeframe: str, symbol: str, path: str, tz='America/New_Yor
     return pd.DataFrame()
 
 def get_dataframe_ib(timeframe: str, symbol: str, path: str, tz='America/New_York') -> Optional[pd.DataFrame]:
-    p = os.path.expanduser(os.path.join(path, timeframe, f"{symbol}.csv"))
+    p = bars_path('ib', symbol, timeframe, path)
     try:
         df = pd.read_csv(p, dtype={'Open': np.float32, 'High': np.float32, 'Low': np.float32, 'Close': np.float32, 'Volume': np.float32}, parse_dates=True, index_col='Date')
         # TODO need to convert to TZ America/New_York ?
@@ -282,13 +643,127 @@ def json_to_dataframe(symbol: str, timeframe: str, data: Optional[Dict]) -> pd.D
     return df
 
 
-def get_dataframe_alpaca_file(timeframe: str, symbol: str, path: str) -> Union[pd.DataFrame, None]:
-    file_path = os.path.expanduser(f"{path}{os.sep}{timeframe}{os.sep}{symbol}.json")
-    json_data = load_json_data(symbol, file_path)
-    return json_to_dataframe(symbol, timeframe, json_data)
+JSON_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+JSON_CHUNK_SIZE = 4 * 1024**2
+_JSON_DATETIME_RE = re.compile(rb'"DateTime"\s*:\s*"([^"]*)"')
+_JSON_COLUMN_RES = {col: re.compile(rb'"' + col.encode() + rb'"\s*:\s*([^,}\s]+)') for col in JSON_COLUMNS}
+
+
+def _json_floats(values: List[bytes]) -> np.ndarray:
+    try:
+        return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+    except ValueError:
+        # e.g. null values
+        return pd.to_numeric(pd.Series(values).str.decode('ascii'), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _json_timestamps(values: np.ndarray, tz: str) -> np.ndarray:
+    # Epoch ns in (naive) 'tz' time for ISO 8601 timestamps, parsed by numpy when they are all UTC ('...Z')
+    if len(values) and np.char.endswith(values, b'Z').all():
+        utc = np.char.rstrip(values, b'Z').astype('datetime64[ns]').view(np.int64)
+        index = pd.DatetimeIndex(utc, tz='UTC')
+    else:
+        index = pd.to_datetime(values.astype(str), utc=True, format='ISO8601')
+    return index.tz_convert(tz).tz_localize(None).as_unit('ns').asi8
+
+
+def _parse_json_bars(segment: bytes, start: Optional[pd.Timestamp], end: Optional[pd.Timestamp]) -> Optional[Dict[str, np.ndarray]]:
+    # One regex pass per column over a run of complete bar objects. The price columns are only parsed if any bar is within [start, end)
+    timestamps = _json_timestamps(np.array(_JSON_DATETIME_RE.findall(segment), dtype=np.bytes_), 'America/New_York')
+    keep = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        keep &= timestamps >= start.value
+    if end is not None:
+        keep &= timestamps < end.value
+    if not keep.any():
+        return None
+    columns = {col: _json_floats(regex.findall(segment)) for col, regex in _JSON_COLUMN_RES.items()}
+    if any(len(values) != len(timestamps) for values in columns.values()):
+        raise ValueError("Bars with missing fields")
+    columns['DateTime'] = timestamps
+    if not keep.all():
+        columns = {col: values[keep] for col, values in columns.items()}
+    return columns
+
+
+def stream_json_dataframe(symbol: str, timeframe: str, path: str,
+                          start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    Same result as json_to_dataframe(load_json_data(...)) limited to [start, end), but the file is read in chunks and
+    the bar array of 'symbol' is parsed straight into typed columns (float64 prices/volume, int64 epoch ns), without
+    building the JSON document or a dict per bar. Chunks without bars in [start, end) are skipped after parsing their
+    timestamps.
+    """
+    logger.debug(f"{symbol}: streaming json data '{path}'")
+    key_re = re.compile(rb'"' + re.escape(symbol.encode()) + rb'"\s*:\s*\[')
+    start = pd.Timestamp(start).as_unit('ns') if start is not None else None
+    end = pd.Timestamp(end).as_unit('ns') if end is not None else None
+
+    chunks = []
+    found = False
+    buffer = b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(JSON_CHUNK_SIZE)
+            buffer += data
+            if not found:
+                match = key_re.search(buffer)
+                if match is None:
+                    if not data:
+                        break
+                    buffer = buffer[-(len(symbol) + 64):]
+                    continue
+                found = True
+                buffer = buffer[match.end():]
+            # Bar objects contain no brackets, so the first ']' ends the symbol's array
+            array_end = buffer.find(b']')
+            if array_end >= 0:
+                chunks.append(_parse_json_bars(buffer[:array_end], start, end))
+                break
+            if not data:
+                raise ValueError(f"Unterminated bar array for '{symbol}' in '{path}'")
+            last_bar = buffer.rfind(b'}') + 1
+            chunks.append(_parse_json_bars(buffer[:last_bar], start, end))
+            buffer = buffer[last_bar:]
+
+    chunks = [chunk for chunk in chunks if chunk is not None]
+    if not found:
+        logger.warning(f"Missing symbol '{symbol}' in file '{path}'")
+    if not chunks:
+        return json_to_dataframe(symbol, timeframe, None)
+
+    index = np.concatenate([chunk['DateTime'] for chunk in chunks]).view('datetime64[ns]')
+    df = pd.DataFrame({col: np.concatenate([chunk[col] for chunk in chunks]) for col in JSON_COLUMNS}, index=pd.DatetimeIndex(index, name='DateTime'))
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    df.attrs = {'symbol': symbol, 'timeframe': timeframe}
+    return df
+
+
+def get_dataframe_alpaca_file(timeframe: str, symbol: str, path: str, use_cache: bool = True,
+                              start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None, copy: bool = True) -> Union[pd.DataFrame, None]:
+    """
+    Load bars within [start, end). With 'use_cache' only that row range is read from the columnar cache, without 'copy'
+    as read only memory mapped views.
+    """
+    file_path = bars_path('alpaca-file', symbol, timeframe, path)
+
+    if use_cache:
+        # The full history is parsed (once) to build the cache
+        df = cache.cached(file_path, lambda: stream_json_dataframe(symbol, timeframe, file_path), start, end, copy=copy)
+    else:
+        df = stream_json_dataframe(symbol, timeframe, file_path, start, end)
+        if df.empty:
+            return df
+    # Used by utils_ta.add_ta_cached to locate the indicator cache
+    df.attrs['source'] = file_path
+    return df
 
 
-def get_dataframe(provider, symbol, start, end, timeframe, rth_only=False, path=None, transform='') -> pd.DataFrame:
+def get_dataframe(provider, symbol, start, end, timeframe, rth_only=False, path=None, transform='', use_cache=True, copy=True) -> pd.DataFrame:
+    """
+    copy: False to get the cached bars as read only memory mapped views (shared by all processes reading them)
+    """
     if not path:
         raise Exception(f"Missing path for provider '{provider}'")
 
@@ -297,10 +772,12 @@ def get_dataframe(provider, symbol, start, end, timeframe, rth_only=False, path=
         lambda df: filter_rth(df) if rth_only else df,
         lambda df: filter_date(df, start, end),
     )
+    # Widened to whole periods of 'transform', filter_date does the exact trim after the transform
+    lower, upper = date_bounds(start, end, transform if transform != timeframe else '')
     if provider == 'tv':
-        return post_process(get_dataframe_tv(timeframe=timeframe, symbol=symbol, path=path))
+        return post_process(get_dataframe_tv(timeframe=timeframe, symbol=symbol, path=path, use_cache=use_cache, start=lower, end=upper, copy=copy))
     elif provider == 'alpaca-file':
-        return post_process(get_dataframe_alpaca_file(timeframe=timeframe, symbol=symbol, path=path))
+        return post_process(get_dataframe_alpaca_file(timeframe=timeframe, symbol=symbol, path=path, use_cache=use_cache, start=lower, end=upper, copy=copy))
     elif provider == 'ib':
         return post_process(get_dataframe_ib(timeframe=timeframe, symbol=symbol, path=path))
     else:
@@ -319,7 +796,20 @@ def get_symbols(symbol_list):
     return symbols
 
 
+def _store_dataframe(store_dir, provider, symbol, start, end, timeframe, rth_only, path, transform) -> Union[cache.BarsRef, pd.DataFrame, None]:
+    # Pool worker of get_dataframes, returns where the bars are stored instead of the pickled frame
+    df = get_dataframe(provider, symbol, start, end, timeframe, rth_only, path, transform, copy=False)
+    if df.empty:
+        return None
+    ref = cache.store_bars(os.path.join(store_dir, f"{symbol}-{transform or timeframe}"), df)
+    return ref if ref is not None else df
+
+
 def get_dataframes(provider, symbol_list, start, end, timeframe, rth_only=False, path=None, transform='', process_workers=0) -> List[pd.DataFrame]:
+    """
+    With 'process_workers' the workers write the bars to a temporary bar store and the returned frames are read only
+    memory mapped views of it, so no frames are pickled or held twice
+    """
     if not path:
         raise Exception(f"Missing path for provider '{provider}'")
 
@@ -327,9 +817,15 @@ def get_dataframes(provider, symbol_list, start, end, timeframe, rth_only=False,
     dfs = []
 
     if process_workers > 0:
-        with Pool(process_workers) as pool:
-            dfs = pool.starmap(get_dataframe, [(provider, symbol, start, end, timeframe, rth_only, path, transform) for symbol in symbols])
-            dfs = [df for df in dfs if not df.empty]
+        store_dir = tempfile.mkdtemp(prefix='bars-')
+        try:
+            with Pool(process_workers) as pool:
+                results = pool.starmap(_store_dataframe, [(store_dir, provider, symbol, start, end, timeframe, rth_only, path, transform) for symbol in symbols])
+            dfs = [cache.open_bars(result) if isinstance(result, cache.BarsRef) else result for result in results]
+            dfs = [df for df in dfs if df is not None]
+        finally:
+            # The mapped views stay valid after their files are removed
+            shutil.rmtree(store_dir, ignore_errors=True)
     else:
         for symbol in symbols:
             df = get_dataframe(provider, symbol, start, end, timeframe, rth_only, path, transform)
@@ -1,28 +1,216 @@
-from finta import TA
+import hashlib
+
+import numpy as np
 import pandas as pd
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from trade_screenshots import cache, instrument
+
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+# Bar columns the indicators are computed from, see rows_fingerprint()
+TA_INPUT_COLUMNS = ['High', 'Low', 'Close', 'Volume']
+
+BB_PERIOD = 20
+BB_STD_MULTIPLIER = 2.0
+
+
+def day_starts(index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Positions in 'index' where a new day starts, always including 0 for a non-empty index
+    """
+    if len(index) == 0:
+        return np.array([], dtype=np.int64)
+    days = index.as_unit('ns').asi8 // NS_PER_DAY
+    return np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+
+
+def time_mask(index: pd.DatetimeIndex, start_time: str, end_time: str) -> np.ndarray:
+    """
+    Same rows as df.between_time(start_time, end_time, inclusive='left'), as a boolean mask
+    """
+    start = pd.Timedelta(f"{start_time}:00").value // NS_PER_MINUTE
+    end = pd.Timedelta(f"{end_time}:00").value // NS_PER_MINUTE
+    minute_of_day = (index.as_unit('ns').asi8 % NS_PER_DAY) // NS_PER_MINUTE
+    return (minute_of_day >= start) & (minute_of_day < end)
+
+
+def _segments(n: int, starts: Optional[np.ndarray]):
+    if starts is None or len(starts) == 0:
+        return [(0, n)]
+    return zip(starts, np.append(starts[1:], n))
+
+
+def ema_update(close: np.ndarray, period: int, starts: Optional[np.ndarray] = None, state: Optional[Dict] = None) -> Tuple[np.ndarray, Optional[Dict]]:
+    """
+    Same as finta TA.EMA (adjusted ewm), restarted at each position in 'starts'.
+
+    'state' holds the ewm weighted sums after the bar preceding close[0] and continues the EMA into the first segment,
+    the returned state continues it after the last bar.
+    """
+    beta = 1 - 2 / (period + 1)
+    result = np.empty(len(close))
+    for a, b in _segments(len(close), starts):
+        if b == a:
+            continue
+        mean = pd.Series(close[a:b]).ewm(span=period, adjust=True).mean().to_numpy()
+        decay = beta ** np.arange(1, b - a + 1)
+        den = (1 - decay) / (1 - beta)
+        num = mean * den
+        if state is not None and a == 0:
+            num += decay * state['num']
+            den += decay * state['den']
+            mean = num / den
+        result[a:b] = mean
+        state = {'num': float(num[-1]), 'den': float(den[-1])}
+    return result, state
+
+
+def vwap_update(high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray,
+                starts: Optional[np.ndarray] = None, state: Optional[Dict] = None) -> Tuple[np.ndarray, Optional[Dict]]:
+    # Same as finta TA.VWAP, cumulative sums restarted at each position in 'starts' and continued from 'state'
+    n = len(close)
+    cum_pv = np.cumsum(volume * (high + low + close) / 3)
+    cum_v = np.cumsum(volume, dtype=np.float64)
+    if starts is not None and len(starts) > 1:
+        lengths = np.diff(np.append(starts, n))
+        before = starts[1:] - 1
+        cum_pv -= np.repeat(np.concatenate(([0.0], cum_pv[before])), lengths)
+        cum_v -= np.repeat(np.concatenate(([0.0], cum_v[before])), lengths)
+    if state is not None:
+        first_end = starts[1] if starts is not None and len(starts) > 1 else n
+        cum_pv[:first_end] += state['pv']
+        cum_v[:first_end] += state['v']
+    if n:
+        state = {'pv': float(cum_pv[-1]), 'v': float(cum_v[-1])}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cum_pv / cum_v, state
+
+
+def bbands_update(close: np.ndarray, period: int = BB_PERIOD, std_multiplier: float = BB_STD_MULTIPLIER,
+                  starts: Optional[np.ndarray] = None, state: Optional[Dict] = None) -> Tuple[Tuple[np.ndarray, np.ndarray], Optional[Dict]]:
+    # Same as finta TA.BBANDS (SMA +/- sample std), restarted at each position in 'starts'. The state is the last period-1 closes.
+    upper = np.empty(len(close))
+    lower = np.empty(len(close))
+    for a, b in _segments(len(close), starts):
+        if b == a:
+            continue
+        previous = np.asarray(state['closes'] if state is not None and a == 0 else [], dtype=np.float64)
+        window = np.concatenate((previous, close[a:b]))
+        rolling = pd.Series(window).rolling(window=period)
+        middle = rolling.mean().to_numpy()[len(previous):]
+        std = rolling.std().to_numpy()[len(previous):]
+        upper[a:b] = middle + std_multiplier * std
+        lower[a:b] = middle - std_multiplier * std
+        state = {'closes': window[len(window) - (period - 1):].tolist()}
+    return (upper, lower), state
+
+
+def ema_values(close: np.ndarray, period: int, starts: Optional[np.ndarray] = None) -> np.ndarray:
+    return ema_update(close, period, starts)[0]
+
+
+def vwap_values(high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray, starts: Optional[np.ndarray] = None) -> np.ndarray:
+    return vwap_update(high, low, close, volume, starts)[0]
+
+
+def bbands_values(close: np.ndarray, period: int = BB_PERIOD, std_multiplier: float = BB_STD_MULTIPLIER,
+                  starts: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    return bbands_update(close, period, std_multiplier, starts)[0]
+
+
+def indicator_columns(name: str) -> List[str]:
+    # Columns added for indicator 'name'
+    return ['BB_UPPER', 'BB_LOWER'] if name == 'BB' else [name]
+
+
+def indicator_key(name: str, session_reset: Iterable[str]) -> str:
+    # Identifies an indicator variant, e.g. 'VWAP@day' for a VWAP restarted each day
+    return f"{name}@day" if name in session_reset else name
+
+
+def indicators_update(df: pd.DataFrame, ta: List[str], start_time='', end_time='', session_reset: Iterable[str] = (),
+                      states: Optional[Dict[str, Dict]] = None) -> Tuple[Dict[str, np.ndarray], Dict[str, Dict]]:
+    """
+    indicators() continued from 'states' (keyed by indicator_key) of the bars preceding df, e.g. to only compute
+    indicators for bars appended since the last run. Returns the new columns and the states after the last bar.
+    """
+    n = len(df)
+    states = states or {}
+    mask = time_mask(df.index, start_time, end_time) if start_time and end_time else None
+    index = df.index[mask] if mask is not None else df.index
+    starts = day_starts(index)
+    days = index.as_unit('ns').asi8 // NS_PER_DAY
+
+    def column(name):
+        values = df[name].to_numpy(dtype=np.float64)
+        return values[mask] if mask is not None else values
+
+    close = column('Close')
+    result = {}
+    new_states = {}
+    for name in ta:
+        key = indicator_key(name, session_reset)
+        state = states.get(key)
+        resets = None
+        if name in session_reset:
+            resets = starts
+            if state is not None and len(days) and state.get('day') != int(days[0]):
+                # A new day has started since the state was saved
+                state = None
+        if name == 'VWAP':
+            result['VWAP'], state = vwap_update(column('High'), column('Low'), close, column('Volume'), resets, state)
+        elif name.startswith('EMA') and name[3:].isdigit():
+            result[name], state = ema_update(close, int(name[3:]), resets, state)
+        elif name == 'BB':
+            (result['BB_UPPER'], result['BB_LOWER']), state = bbands_update(close, starts=resets, state=state)
+        else:
+            continue
+        if state is not None and resets is not None and len(days):
+            state['day'] = int(days[-1])
+        new_states[key] = state
+
+    if mask is not None:
+        for name, values in result.items():
+            full = np.full(n, np.nan)
+            full[mask] = values
+            result[name] = full
+    return result, new_states
+
+
+def indicators(df: pd.DataFrame, ta: List[str], start_time='', end_time='', session_reset: Iterable[str] = ()) -> Dict[str, np.ndarray]:
+    """
+    Compute the indicators in 'ta' ('VWAP', 'EMA<period>', 'BB') in one pass over the OHLCV columns and return
+    the new columns only, aligned with df.index.
+
+    With start_time/end_time only the bars within that time of day are used (other rows get NaN). Indicators
+    in 'session_reset' restart at each day, e.g. a daily VWAP.
+    """
+    return indicators_update(df, ta, start_time, end_time, session_reset)[0]
 
 
 def ema(df: pd.DataFrame, period: int) -> pd.DataFrame:
-    df[f"EMA{period}"] = TA.EMA(df, period)
+    df[f"EMA{period}"] = ema_values(df['Close'].to_numpy(dtype=np.float64), period)
     return df
 
 
-def vwap(df: pd.DataFrame) -> pd.DataFrame:
-    df['VWAP'] = TA.VWAP(df)
+def vwap(df: pd.DataFrame, start_time='', end_time='') -> pd.DataFrame:
+    # VWAP restarted for each day in df, with start_time/end_time over the bars within that time of day only
+    df['VWAP'] = indicators(df, ['VWAP'], start_time, end_time, session_reset=['VWAP'])['VWAP']
     return df
 
 
-def mid(df: pd.DataFrame) -> pd.DataFrame:
-    # Assume df is 1 intraday, RTH only
-    max_high_values = [df['High'].iloc[0]]
-    min_low_values = [df['Low'].iloc[0]]
-    for index, row in df.iloc[1:].iterrows():
-        max_high_values.append(max(max_high_values[-1], row['High']))
-        min_low_values.append(min(min_low_values[-1], row['Low']))
-
-    mid = (pd.Series(max_high_values, index=df.index) + pd.Series(min_low_values, index=df.index)) / 2
-    df['Mid'] = mid
+def mid(df: pd.DataFrame, start_time='', end_time='') -> pd.DataFrame:
+    # Running mid of the day's range, restarted for each day in df, with start_time/end_time over the bars within that
+    # time of day only (other rows get NaN)
+    mask = time_mask(df.index, start_time, end_time) if start_time and end_time else np.ones(len(df), dtype=bool)
+    high, low = df['High'][mask], df['Low'][mask]
+    days = high.index.normalize()
+    values = np.full(len(df), np.nan)
+    values[mask] = ((high.groupby(days).cummax() + low.groupby(days).cummin()) / 2).to_numpy()
+    df['Mid'] = values
     return df
 
 
@@ -32,41 +220,170 @@ def or_levels(df: pd.DataFrame, or_times: Tuple[str, str]) -> Tuple[float, float
 
 
 def bbands(df: pd.DataFrame) -> pd.DataFrame:
-    bb = TA.BBANDS(df, period=20, std_multiplier=2.0)
-    df['BB_UPPER'] = bb['BB_UPPER']
-    df['BB_LOWER'] = bb['BB_LOWER']
+    df['BB_UPPER'], df['BB_LOWER'] = bbands_values(df['Close'].to_numpy(dtype=np.float64))
     return df
 
 
-def add_ta(symbol: str, df: pd.DataFrame, ta: List[str], start_time = '', end_time = '', separate_by_day=False) -> pd.DataFrame:
-    if separate_by_day:
-        # Apply this TA on a day by day basis, e.g. VWAP or mid
-        dfs = [group_df for _, group_df in df.groupby(df.index.date)]
-    else:
-        dfs = [df]
-    
-    result_dfs = []
-    for df in dfs:
-        if start_time and end_time:
-            # Filter out rows outside start/end time before applying TA
-            df_ta = df.between_time(start_time, end_time, inclusive='left').copy()
+def add_ta(symbol: str, df: pd.DataFrame, ta: List[str], start_time = '', end_time = '', separate_by_day=False,
+           session_reset: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Return df with the indicator columns in 'ta' added. The result is a shallow copy, i.e. the OHLCV columns are
+    shared with 'df' and only the indicator columns are allocated.
+
+    separate_by_day: restart all indicators at each day, 'session_reset' does the same for individual indicators (e.g. VWAP)
+    """
+    columns = indicators(df, ta, start_time, end_time, session_reset=ta if separate_by_day else session_reset)
+    result = df.copy(deep=False)
+    for name, values in columns.items():
+        result[name] = values
+    return result
+
+
+def ta_cache_group(df: pd.DataFrame, start_time='', end_time='') -> str:
+    group = df.attrs.get('timeframe', '')
+    if start_time and end_time:
+        group += f"_{start_time}-{end_time}".replace(':', '')
+    return group
+
+
+def rows_fingerprint(df: pd.DataFrame, rows: int) -> str:
+    """
+    Hash of the indicator inputs of the first 'rows' bars of 'df'. Cached indicators are only continued if the bars they
+    were computed from are unchanged, not just their timestamps (e.g. split adjusted history).
+    """
+    h = hashlib.sha1()
+    for col in TA_INPUT_COLUMNS:
+        if col in df.columns:
+            h.update(col.encode())
+            h.update(np.ascontiguousarray(df[col].to_numpy(dtype=np.float64)[:rows]).tobytes())
+    return h.hexdigest()
+
+
+def add_ta_cached(symbol: str, df: pd.DataFrame, ta: List[str], start_time='', end_time='', session_reset: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    add_ta() backed by an indicator cache stored with the bar cache of df.attrs['source'] (set by the data loaders).
+
+    The values and final state (EMA sums, last closes for BB, VWAP sums) of each indicator are saved, so when bars have
+    been appended to the data since the last run only the new bars are computed. Cached values are only used if df
+    starts with the same bars they were computed for (timestamps and rows_fingerprint()), otherwise everything is
+    recomputed and the cache replaced.
+    """
+    source = df.attrs.get('source')
+    if not source or df.empty:
+        return add_ta(symbol, df, ta, start_time, end_time, session_reset=session_reset)
+
+    directory = cache.ta_cache_dir(source, ta_cache_group(df, start_time, end_time))
+    index = df.index.as_unit('ns').asi8
+    cached = cache.load_ta(directory)
+    valid_rows, states, writable = 0, {}, True
+    if cached is not None:
+        cached_index, states = cached
+        rows = min(len(cached_index), len(index))
+        if np.array_equal(cached_index[:rows], index[:rows]):
+            valid_rows = rows
+            # Don't replace a cache covering more bars than df
+            writable = len(cached_index) <= len(index)
         else:
-            df_ta = df.copy()
-        if 'VWAP' in ta:
-            df_ta = vwap(df_ta)
-        if 'EMA10' in ta:
-            df_ta = ema(df_ta, 10)
-        if 'EMA20' in ta:
-            df_ta = ema(df_ta, 20)
-        if 'EMA50' in ta:
-            df_ta = ema(df_ta, 50)
-        if 'BB' in ta:
-            df_ta = bbands(df_ta)
-        if start_time and end_time:
-            # Stitch the time filtered df (with TA) back together with original df
-            result_dfs.append(df_ta.combine_first(df))
+            states = {}
+
+    fingerprints: Dict[int, str] = {}
+
+    def fingerprint(rows):
+        if rows not in fingerprints:
+            fingerprints[rows] = rows_fingerprint(df, rows)
+        return fingerprints[rows]
+
+    result = df.copy(deep=False)
+    updated, new_states = {}, dict(states)
+    for name in ta:
+        key = indicator_key(name, session_reset)
+        saved = states.get(key)
+        valid = saved is not None and saved['rows'] <= valid_rows and saved.get('fingerprint') == fingerprint(saved['rows'])
+        start, state = (saved['rows'], saved['state']) if valid else (0, None)
+        instrument.count('ta_cache.hit' if start > 0 else 'ta_cache.miss')
+        columns, tail_states = indicators_update(df.iloc[start:], [name], start_time, end_time, session_reset, {key: state} if state else None)
+        for column, values in columns.items():
+            stored_name = f"{column}@day" if name in session_reset else column
+            if start > 0:
+                values = np.concatenate((cache.load_ta_column(directory, stored_name)[:start], values))
+            if start < len(df):
+                updated[stored_name] = values
+            result[column] = values
+        if start < len(df) and key in tail_states:
+            new_states[key] = {'rows': len(df), 'state': tail_states[key], 'fingerprint': fingerprint(len(df))}
+
+    if updated and writable:
+        cache.store_ta(directory, index, updated, new_states)
+    return result
+
+
+def warmup_bars(name: str) -> int:
+    """
+    Number of bars an indicator needs before a window to reach (close to) the value it has over the full history.
+    EMAs never fully forget, after 3x the period less than 0.3% of the weight is on older bars.
+    """
+    if name.startswith('EMA') and name[3:].isdigit():
+        return 3 * int(name[3:])
+    if name == 'BB':
+        return BB_PERIOD
+    return 0
+
+
+def merge_windows(df: pd.DataFrame, windows: List[Tuple[pd.Timestamp, pd.Timestamp]], warmup: int,
+                  mask: Optional[np.ndarray] = None, day_aligned=False) -> List[Tuple[int, int]]:
+    """
+    Row ranges [lo, hi) covering each [start, end) window in 'windows' plus 'warmup' bars (counting only rows in
+    'mask') before it, merged where they overlap. With 'day_aligned' a range always starts at the beginning of a day.
+    """
+    index = df.index.as_unit('ns').asi8
+    counted = np.concatenate(([0], np.cumsum(mask if mask is not None else np.ones(len(index), dtype=bool))))
+    first_of_day = day_starts(df.index)
+    ranges = []
+    for start, end in windows:
+        lo, hi = cache.row_range(index, start, end)
+        if lo == hi:
+            continue
+        lo = max(0, int(np.searchsorted(counted, counted[lo] - warmup, side='right')) - 1)
+        if day_aligned:
+            lo = int(first_of_day[np.searchsorted(first_of_day, lo, side='right') - 1])
+        ranges.append((lo, hi))
+
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
         else:
-            result_dfs.append(df_ta)
-        
-    return pd.concat(result_dfs)
-    
+            merged.append((lo, hi))
+    return merged
+
+
+def add_ta_windows(symbol: str, df: pd.DataFrame, ta: List[str], windows: List[Tuple[pd.Timestamp, pd.Timestamp]],
+                   start_time='', end_time='', session_reset: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    add_ta() evaluated only over the [start, end) 'windows' (e.g. the bars shown on trade charts) plus each indicator's
+    warm-up, with overlapping windows computed together. Rows outside the windows get NaN.
+
+    A VWAP that isn't restarted each day depends on the full history and is computed over all of df.
+
+    BB and VWAP match add_ta() exactly. An EMA only approximates it: the bars before the warm-up are dropped, whose weight
+    is at most (1 - 2 / (period + 1)) ** (3 * period) < 0.25%. Within the windows an EMA is therefore off by less than
+    0.25% of the difference between the earlier closes and those of the warm-up, i.e. within 0.25% of the close range of
+    df (both with and without start_time/end_time).
+    """
+    full_history = [name for name in ta if name == 'VWAP' and name not in session_reset]
+    windowed = [name for name in ta if name not in full_history]
+    result = add_ta(symbol, df, full_history, start_time, end_time, session_reset=session_reset)
+    if not windowed:
+        return result
+
+    mask = time_mask(df.index, start_time, end_time) if start_time and end_time else None
+    warmup = max(warmup_bars(name) for name in windowed)
+    day_aligned = any(name in session_reset for name in windowed)
+    columns = {}
+    for lo, hi in merge_windows(df, windows, warmup, mask, day_aligned):
+        for name, values in indicators(df.iloc[lo:hi], windowed, start_time, end_time, session_reset).items():
+            columns.setdefault(name, np.full(len(df), np.nan))[lo:hi] = values
+    for name in windowed:
+        for column in indicator_columns(name):
+            result[column] = columns.get(column, np.full(len(df), np.nan))
+    return result